@@ -3,15 +3,16 @@ import os
 import sys
 import time
 
+import gradio as gr
 import tiktoken
 from dotenv import load_dotenv
 from openai import AzureOpenAI
 
 sys.path.append('../../')
 
-from demos.tool_calling.tool_descriptors import tools_rag_descriptor
+from demos.tool_calling.tool_descriptors import declared_arguments, tools_rag_descriptor
 # noinspection PyUnresolvedReferences
-from fn_rag import lookup_in_documentation, list_documents
+from fn_rag import rag_tools, user_namespace
 
 load_dotenv()
 
@@ -74,21 +75,18 @@ def append_user(message, chat_history):
     return chat_history
 
 
-def call_to_action(run, thread):
+def call_to_action(run, thread, namespace=None):
     function_calls = run.required_action.submit_tool_outputs.tool_calls
     function_results = {}
+    session_tools = rag_tools(namespace)  # only search the documents of the user
     for function_call in function_calls:
         function_name = function_call.function.name
         print(f"Function name: {function_name}")
-        fn_pointer = globals()[function_name]
+        fn_pointer = session_tools.get(function_name)
 
         if fn_pointer is not None:
-            arguments = json.loads(function_call.function.arguments)
-            if 'query' in arguments:
-                query = arguments["query"]
-                result = fn_pointer(query)
-            else:
-                result = fn_pointer()
+            arguments = json.loads(function_call.function.arguments or '{}')
+            result = fn_pointer(**declared_arguments(tools, function_name, arguments))
             function_results[function_call.id] = result
         else:
             print(f"Unknown function name: {function_name}")
@@ -111,7 +109,7 @@ def call_to_action(run, thread):
     )
 
 
-def append_ai(thread, message, chat_history, log_folder):
+def append_ai(thread, message, chat_history, log_folder, request: gr.Request):
     client.beta.threads.messages.create(
         thread_id=thread.id,
         role="user",
@@ -132,7 +130,7 @@ def append_ai(thread, message, chat_history, log_folder):
         status = run.status
         print(f"Elapsed time: {time_diff} seconds, Status: {status}")
         if run.status == "requires_action":
-            call_to_action(run, thread)
+            call_to_action(run, thread, user_namespace(request.username))
 
     messages = client.beta.threads.messages.list(
         thread_id=thread.id,
@@ -6,26 +6,72 @@ from dotenv import load_dotenv
 sys.path.append('../')
 sys.path.append('../../')
 
-from components.vectorstore.chroma_document_store import ChromaDocumentStore
+from components.text_utils.string_utils import clean_up_string
+from components.vectorstore.chroma_document_store import reciprocal_rank_fusion
+from components.vectorstore.store_pool import DocumentStorePool
 
 load_dotenv()
 
 cdb_path = os.getenv("CHROMA_LOCATION")
-cdb_store = ChromaDocumentStore(path=cdb_path)  # on disk
+# one store per user (or team), opened on first use; backend set by DOCUMENT_STORE_BACKEND
+store_pool = DocumentStorePool(cdb_path,
+                               max_open=int(os.getenv("RAG_MAX_OPEN_STORES", "16")),
+                               idle_timeout=float(os.getenv("RAG_STORE_IDLE_TIMEOUT", "1800")),
+                               query_workers=8,
+                               query_deadline=10.0,
+                               lexical_index=True)
 
+# RAG_TEAMS=alice:research,bob:research lets users share the documents of a team
+user_teams = {}
+for entry in os.getenv("RAG_TEAMS", "").split(','):
+    if ':' in entry:
+        user, team = entry.split(':', 1)
+        user_teams[clean_up_string(user.strip().lower())] = team.strip()
 
-def list_documents():
-    try:
-        return cdb_store.list_documents()
-    except Exception as e:
-        print(e)
-        return []
 
+def user_namespace(username):
+    """Namespace holding the documents of a logged in user: their team, or else their own."""
+    if username is None:
+        return None  # not logged in: the shared store
+    username = clean_up_string(username.lower())
+    return user_teams.get(username, username)
 
-def lookup_in_documentation(query):
-    try:
-        results = cdb_store.query_store(query)
-        return results[:5]
-    except Exception as e:
-        print(e)
-        return []
+
+def rag_tools(namespace=None):
+    """
+    The RAG tools of one session, bound to the namespace of its user on the server side:
+    the model only chooses the arguments in the tool descriptors, never which documents it may read.
+    Logged in users search their own documents and the shared store (read-only for them) together.
+    """
+    namespaces = [None] if namespace is None else [namespace, None]
+
+    def list_documents():
+        document_names = set()
+        for store_namespace in namespaces:
+            try:
+                with store_pool.open_store(store_namespace) as cdb_store:
+                    document_names.update(cdb_store.list_documents())
+            except Exception as e:
+                print(e)
+        return sorted(document_names)
+
+    def lookup_in_documentation(query, where=None, where_document=None):
+        rankings, results_by_key = [], {}
+        for store_namespace in namespaces:
+            try:
+                with store_pool.open_store(store_namespace) as cdb_store:
+                    results = cdb_store.query_store(query, hybrid=True, mmr_lambda=0.7, neighbors=1,
+                                                    where=where, where_document=where_document)[:5]
+            except ValueError as e:  # an invalid filter: let the model correct it
+                return {'error': f'Invalid filter: {e}'}
+            except Exception as e:
+                print(e)
+                continue
+            # chunk ids repeat over documents, so the results are keyed by their rank in their store
+            rankings.append([(store_namespace, rank) for rank in range(len(results))])
+            results_by_key.update({(store_namespace, rank): result for rank, result in enumerate(results)})
+        # the scores of separate stores do not compare, their rankings do
+        fused_scores = reciprocal_rank_fusion(rankings)
+        return [results_by_key[key] for key, _ in fused_scores.most_common(5)]
+
+    return {'list_documents': list_documents, 'lookup_in_documentation': lookup_in_documentation}
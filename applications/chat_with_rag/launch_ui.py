@@ -95,10 +95,10 @@ def show_chat():
     return {cb_live_chat: gr.Chatbot(visible=True)}
 
 
-def on_remove_rag(file_list, select_data):
+def on_remove_rag(file_list, select_data, request: gr.Request):
     if select_data is not None:
         document_name = file_list['Name'][select_data[0]]
-        file_list = remove_collection(document_name)
+        file_list = remove_collection(document_name, request)
     return file_list, None
 
 
@@ -253,8 +253,9 @@ with (gr.Blocks(fill_height=True, title='Pixie Lite') as llm_client_ui):
     llm_client_ui.load(show_chat, [], [cb_live_chat])
 
 # To create a public link, set `share=True` in `launch()`.
-llm_client_ui.queue().launch(auth=auth_method,
-                             server_name='0.0.0.0',
-                             server_port=7025,
-                             allowed_paths=[assets_folder, icons_folder],
-                             css=custom_css)
+if __name__ == '__main__':  # not in the worker processes that convert uploaded files
+    llm_client_ui.queue().launch(auth=auth_method,
+                                 server_name='0.0.0.0',
+                                 server_port=7025,
+                                 allowed_paths=[assets_folder, icons_folder],
+                                 css=custom_css)
@@ -0,0 +1,108 @@
+import argparse
+import random
+import re
+import sys
+import time
+
+sys.path.append('../../')
+
+from components.text_utils.md_chunking import iterative_chunking, merge_small_chunks, split_by_newlines, \
+    split_on_sentences, split_on_threshold
+
+
+def previous_split_by_header(md_text: str, header_level: int = 1) -> list[str]:
+    header_pattern = r'(?=^' + r'#' * header_level + r' )'
+    sections = re.split(header_pattern, md_text, flags=re.MULTILINE)
+    return [sec for sec in sections if sec.strip()]
+
+
+def previous_iterative_chunking(md_text: str, max_size: int = 1024) -> list[str]:
+    """The implementations of iterative_chunking and split_by_header before the rewrite, to compare with."""
+    chunks = [md_text]
+    strategies = [
+        lambda text: previous_split_by_header(text, header_level=1),
+        lambda text: previous_split_by_header(text, header_level=2),
+        lambda text: previous_split_by_header(text, header_level=3),
+        lambda text: previous_split_by_header(text, header_level=4),
+        lambda text: previous_split_by_header(text, header_level=5),
+        lambda text: previous_split_by_header(text, header_level=6),
+        lambda text: split_by_newlines(text, newline_count=4),
+        lambda text: split_by_newlines(text, newline_count=3),
+        lambda text: split_by_newlines(text, newline_count=2),
+        lambda text: split_by_newlines(text, newline_count=1),
+        split_on_sentences,
+        lambda text: split_on_threshold(text, max_chars=max_size, overlap_pct=0.1)
+    ]
+    strat = 0
+
+    while True:
+        if all(len(chunk) <= max_size for chunk in chunks):
+            return chunks
+
+        for c in range(len(chunks)):
+            big_chunk = chunks[c]
+            if len(big_chunk) <= max_size:
+                continue
+            new_chunks = strategies[strat](big_chunk)
+            if len(new_chunks) > 1:
+                new_chunks = merge_small_chunks(new_chunks, max_size=max_size)
+            chunks = chunks[:c] + new_chunks + chunks[c + 1:]
+
+        if strat < len(strategies) - 1:
+            strat += 1
+
+
+WORDS = ['revenue', 'quarter', 'report', 'customer', 'product', 'the', 'of', 'and', 'total', 'region', 'growth',
+         'market', 'a', 'in', 'to', 'service', 'cost', 'sales', 'team', 'for', 'is', 'with', 'year', 'plan']
+
+
+def synthetic_document(size: int, kind: str = 'pdf', seed: int = 0) -> str:
+    """
+    Markdown of about size characters, shaped like a converted PDF (sections of paragraphs)
+    or a converted spreadsheet (one large table per sheet, one row per line).
+    """
+    rng = random.Random(seed)
+    parts, length = [], 0
+    while length < size:
+        if kind == 'spreadsheet':
+            part = f'## Sheet{len(parts) + 1}\n| id | name | region | value |\n| --- | --- | --- | --- |\n' + \
+                   '\n'.join(f'| {row} | {rng.choice(WORDS)} {rng.choice(WORDS)} | {rng.choice(WORDS)} | '
+                             f'{rng.random() * 1000:.2f} |' for row in range(rng.randint(500, 5000)))
+        else:
+            sentences = lambda: ' '.join(' '.join(rng.choices(WORDS, k=rng.randint(6, 20))).capitalize() + '.'
+                                         for _ in range(rng.randint(2, 8)))
+            part = f'# {rng.choice(WORDS).title()} {len(parts)}\n\n' + \
+                   '\n\n'.join(f'## {rng.choice(WORDS).title()}\n\n' + '\n\n'.join(sentences() for _ in range(6))
+                               for _ in range(rng.randint(2, 10)))
+        parts.append(part)
+        length += len(part) + 2
+    return '\n\n'.join(parts)[:size]
+
+
+def time_chunking(chunking_function, md_text: str, max_size: int):
+    start = time.perf_counter()
+    chunks = chunking_function(md_text, max_size)
+    return chunks, time.perf_counter() - start
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares the speed (and output) of iterative_chunking with the '
+                                                 'previous implementation on synthetic converted documents.')
+    parser.add_argument('--sizes-mb', type=float, nargs='+', default=[0.1, 1, 5, 50])
+    parser.add_argument('--kinds', nargs='+', choices=['pdf', 'spreadsheet'], default=['pdf', 'spreadsheet'])
+    parser.add_argument('--max-size', type=int, default=1024)
+    parser.add_argument('--previous-up-to-mb', type=float, default=5,
+                        help='Only run the previous implementation for documents up to this size (it is slow on large ones).')
+    args = parser.parse_args()
+
+    for kind in args.kinds:
+        for size_mb in args.sizes_mb:
+            md_text = synthetic_document(int(size_mb * 1024 * 1024), kind)
+            chunks, seconds = time_chunking(iterative_chunking, md_text, args.max_size)
+            line = f'{kind} {size_mb} MB: {len(chunks)} chunks in {seconds:.2f} s'
+            if size_mb <= args.previous_up_to_mb:
+                previous_chunks, previous_seconds = time_chunking(previous_iterative_chunking, md_text, args.max_size)
+                line += f', previous implementation {previous_seconds:.2f} s ({previous_seconds / seconds:.1f}x)'
+                if previous_chunks != chunks:
+                    line += ' WARNING: different chunks'
+            print(line)
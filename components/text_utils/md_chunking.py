@@ -1,4 +1,7 @@
+import bisect
+import functools
 import re
+from typing import Iterable, Iterator
 
 
 def split_by_header(md_text: str, header_level: int = 1) -> list[str]:
@@ -6,8 +9,10 @@ def split_by_header(md_text: str, header_level: int = 1) -> list[str]:
     Splits Markdown text into sections based on the specified header level.
     For example, header_level=1 splits on '# ', header_level=2 splits on '## ', etc.
     """
-    header_pattern = r'(?=^' + r'#' * header_level + r' )'
-    sections = re.split(header_pattern, md_text, flags=re.MULTILINE)
+    # a header starts a line: search for the newline before it (much faster than trying '^' at every position)
+    header_pattern = r'\n(?=' + r'#' * header_level + r' )'
+    starts = [0] + [match.end() for match in re.finditer(header_pattern, md_text)] + [len(md_text)]
+    sections = [md_text[start:end] for start, end in zip(starts, starts[1:])]
     return [sec for sec in sections if sec.strip()]  # Remove empty sections
 
 
@@ -76,11 +81,16 @@ def split_on_threshold(text: str, max_chars: int = 1024, overlap_pct: float = 0.
     return chunks
 
 
-def iterative_chunking(md_text: str, max_size: int = 1024) -> list[str]:
+def iterative_chunking(md_text: str, max_size: int = 1024, max_tokens: int = None,
+                       encoding_name: str = 'cl100k_base') -> list[str]:
     """
     Iteratively chunk Markdown text using multiple strategies until all chunks are under max_size.
     Strategies: header levels, newlines, sentences, threshold.
+    Every round applies the next strategy to the chunks that are still too big.
+    With max_tokens, chunk sizes are measured in tokens of the given tiktoken encoding instead (see token_chunking).
     """
+    if max_tokens is not None:
+        return token_chunking(md_text, max_tokens, encoding_name)
     chunks = [md_text]
 
     # list of chunking strategies, from coarse to fine
@@ -100,28 +110,179 @@ def iterative_chunking(md_text: str, max_size: int = 1024) -> list[str]:
     ]
     strat = 0
 
-    while True:
-        # if all chunks are small enough, return
-        if all(len(chunk) <= max_size for chunk in chunks):
-            return chunks
+    big_chunks = [(chunks, 0, 0)] if len(md_text) > max_size else []  # (list holding the chunk, index, position)
+    chunk_count = 1
+    while big_chunks:
+        big_chunks, chunk_count = _chunking_round(big_chunks, chunk_count, strategies[strat], max_size)
+        # try next strategy if available
+        if strat < len(strategies) - 1:
+            strat += 1
 
-        for c in range(len(chunks)):
-            big_chunk = chunks[c]
-            if len(big_chunk) <= max_size:
-                continue
+    flat_chunks = []
+    _flatten_chunks(chunks, flat_chunks)
+    return flat_chunks
 
-            # apply current strategy to big chunk
-            new_chunks = strategies[strat](big_chunk)
-            if len(new_chunks) > 1:
-                # merge small chunks if needed
-                new_chunks = merge_small_chunks(new_chunks, max_size=max_size)
 
-            # replace original big chunk with new chunks
-            chunks = chunks[:c] + new_chunks + chunks[c + 1:]
+def _chunking_round(big_chunks: list, chunk_count: int, strategy, max_size: int) -> tuple[list, int]:
+    """
+    Split the chunks that are too big with one strategy. Each is replaced (in its list) by the list of its parts,
+    so only the big chunks are visited, not the whole document.
+    A round visits as many positions as there were chunks at its start: the parts of a split chunk
+    push the following chunks back, and those that end up beyond the last position wait for the next round
+    (and the next strategy). This decides which strategy splits which section, so chunk boundaries stay the same.
+    Returns the big chunks for the next round and the new number of chunks.
+    """
+    next_big_chunks = []
+    shift = 0  # change of the number of chunks so far
+    next_position = 0  # the first position that can still be visited
+    for chunks, index, position in big_chunks:
+        position += shift
+        if position < next_position or position >= chunk_count:
+            next_big_chunks.append((chunks, index, position))
+            continue
 
-        # try next strategy if available
-        if strat < len(strategies) - 1:
-            strat += 1
+        # apply current strategy to big chunk
+        new_chunks = strategy(chunks[index])
+        if len(new_chunks) > 1:
+            # merge small chunks if needed
+            new_chunks = merge_small_chunks(new_chunks, max_size=max_size)
+        chunks[index] = new_chunks
+        shift += len(new_chunks) - 1
+        next_position = position + 1
+
+        # big parts are returned unchanged by the same strategy, so they are left for the next round
+        next_big_chunks += [(new_chunks, i, position + i) for i, chunk in enumerate(new_chunks) if len(chunk) > max_size]
+    return next_big_chunks, chunk_count + shift
+
+
+def _flatten_chunks(chunks: list, flat_chunks: list):
+    for chunk in chunks:
+        if isinstance(chunk, list):
+            _flatten_chunks(chunk, flat_chunks)
+        else:
+            flat_chunks.append(chunk)
+
+
+@functools.lru_cache(maxsize=None)
+def token_encoder(encoding_name: str = 'cl100k_base'):
+    """The tiktoken encoding with this name, loaded once per process."""
+    import tiktoken  # only needed for token-based chunking
+    return tiktoken.get_encoding(encoding_name)
+
+
+def token_chunking(md_text: str, max_tokens: int = 256, encoding_name: str = 'cl100k_base') -> list[str]:
+    """
+    Chunk Markdown text into chunks of at most max_tokens tokens, with the same strategies as iterative_chunking.
+    The text is encoded once; the size of any part of it is counted from the character offsets of its tokens,
+    so candidate chunks are never encoded again. Sections that are too big are split with the next strategy,
+    adjacent parts are merged as long as they fit (keeping the text between them).
+    A chunk encoded on its own can differ by a token or so at its edges.
+    """
+    encoder = token_encoder(encoding_name)
+    _, token_starts = encoder.decode_with_offsets(encoder.encode(md_text, disallowed_special=()))
+
+    def first_token(position: int) -> int:
+        # the token that contains position
+        return max(bisect.bisect_right(token_starts, position) - 1, 0)
+
+    def token_count(start: int, end: int) -> int:
+        return bisect.bisect_left(token_starts, end) - first_token(start) if end > start else 0
+
+    def split_on(pattern):
+        def split(start: int, end: int) -> list[tuple[int, int]]:
+            parts = []
+            for match in pattern.finditer(md_text, start, end):
+                parts.append((start, match.start()))
+                start = match.end()
+            parts.append((start, end))
+            return [(s, e) for s, e in parts if md_text[s:e].strip()]
+        return split
+
+    def split_on_tokens(start: int, end: int) -> list[tuple[int, int]]:
+        # cut after max_tokens tokens, rounded back to the previous whitespace, with 10% overlap (as split_on_threshold)
+        overlap = int(max_tokens * 0.1)
+        parts = []
+        while start < end:
+            if token_count(start, end) <= max_tokens:
+                parts.append((start, end))
+                break
+            cut = max(token_starts[first_token(start) + max_tokens], start + 1)
+            last_whitespace = md_text.rfind(' ', start + 1, cut)
+            if last_whitespace != -1:
+                cut = last_whitespace
+            parts.append((start, cut))
+            next_start = token_starts[max(first_token(cut) - overlap, 0)]
+            start = next_start if start < next_start < cut else cut
+        return parts
+
+    def merge_small_parts(parts: list[tuple[int, int]]) -> list[tuple[int, int]]:
+        merged = [parts[0]]
+        for start, end in parts[1:]:
+            if token_count(merged[-1][0], end) <= max_tokens:
+                merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        return merged
+
+    # from coarse to fine, as in iterative_chunking
+    strategies = [split_on(re.compile(r'\n(?=' + '#' * header_level + ' )')) for header_level in range(1, 7)] + \
+                 [split_on(re.compile(r'\n{' + str(newline_count) + r',}\s*')) for newline_count in [4, 3, 2, 1]] + \
+                 [split_on(re.compile(r'(?<=[.!?])\s+')), split_on_tokens]
+
+    chunks = []
+
+    def chunk_part(start: int, end: int, strat: int):
+        if token_count(start, end) <= max_tokens or strat == len(strategies):
+            chunk = md_text[start:end].strip()
+            if chunk:
+                chunks.append(chunk)
+            return
+        parts = strategies[strat](start, end)
+        if len(parts) > 1:
+            parts = merge_small_parts(parts)
+        for part_start, part_end in parts:
+            chunk_part(part_start, part_end, strat + 1)
+
+    chunk_part(0, len(md_text), 0)
+    return chunks
+
+
+def stream_chunking(md_blocks: Iterable[str], max_size: int = 1024, window_size: int = None,
+                    max_tokens: int = None, encoding_name: str = 'cl100k_base') -> Iterator[str]:
+    """
+    Chunk Markdown text that arrives in pieces (e.g. the lines of a file), yielding chunks as soon as they are made.
+    Besides the current piece, at most about window_size characters are held: text is cut before the last header
+    in the window (highest level first), else after the last blank line, line or sentence, and each part is chunked
+    with iterative_chunking (same strategies). Chunks can differ from chunking the whole text at once near the cuts.
+    """
+    if window_size is None:
+        window_size = 64 * max_size if max_tokens is None else 256 * max_tokens
+    pending = ''
+    for block in md_blocks:
+        pending += block
+        start = 0
+        while len(pending) - start >= window_size:
+            cut = _stream_cut(pending, start + window_size // 2, start + window_size)
+            chunks = iterative_chunking(pending[start:cut], max_size, max_tokens, encoding_name)
+            yield from (chunk for chunk in chunks if chunk.strip())
+            start = cut
+        pending = pending[start:]
+    if pending.strip():
+        chunks = iterative_chunking(pending, max_size, max_tokens, encoding_name)
+        yield from (chunk for chunk in chunks if chunk.strip())
+
+
+def _stream_cut(text: str, first: int, last: int) -> int:
+    """Position between first and last to cut text at, following the order of the chunking strategies."""
+    for header_level in range(1, 7):
+        position = text.rfind('\n' + '#' * header_level + ' ', first, last)
+        if position != -1:
+            return position + 1
+    for separator in ['\n\n', '\n', '. ']:
+        position = text.rfind(separator, first, last)
+        if position != -1:
+            return position + len(separator)
+    return last
 
 
 def merge_small_chunks(small_chunks: list[str], max_size: int = 1024) -> list[str]:
@@ -144,3 +305,73 @@ def merge_small_chunks(small_chunks: list[str], max_size: int = 1024) -> list[st
         merged.append(current)
 
     return merged
+
+
+def chunk_offsets(md_text: str, chunks: list[str]) -> list[tuple[int, int]]:
+    """
+    Locate each chunk in the Markdown text it was made from, as (start, end) character offsets.
+    Merged chunks lose whitespace between their parts, so chunks are matched against the text without whitespace.
+    Chunks are searched in order, returns (-1, -1) for a chunk that cannot be found.
+    """
+    # the text without whitespace, with the start of every run of non-whitespace in both texts
+    run_starts, compact_run_starts, runs = [], [], []
+    compact_length = 0
+    for match in re.finditer(r'\S+', md_text):
+        run_starts.append(match.start())
+        compact_run_starts.append(compact_length)
+        runs.append(match.group())
+        compact_length += len(match.group())
+    compact_text = ''.join(runs)
+
+    def to_source(compact_position: int) -> int:
+        run = bisect.bisect_right(compact_run_starts, compact_position) - 1
+        return run_starts[run] + compact_position - compact_run_starts[run]
+
+    offsets = []
+    cursor = 0
+    for chunk in chunks:
+        compact_chunk = ''.join(chunk.split())
+        start = compact_text.find(compact_chunk, cursor) if compact_chunk else -1
+        if start == -1:
+            offsets.append((-1, -1))
+            continue
+        end = start + len(compact_chunk)
+        offsets.append((to_source(start), to_source(end - 1) + 1))
+        cursor = start + 1  # overlapping chunks start before the previous one ends
+    return offsets
+
+
+def chunk_records(md_text: str, max_size: int = 1024, max_tokens: int = None,
+                  encoding_name: str = 'cl100k_base') -> list[dict]:
+    """
+    Chunk Markdown text (see iterative_chunking) and describe where each chunk comes from, as
+    {'text': chunk, 'metadata': {'char_start', 'char_end', 'header_path', 'page_start', 'page_end'}}.
+    header_path lists the headers above the start of the chunk ('Chapter > Section'), pages are only given
+    when the text has page breaks (form feeds, as in text extracted from PDFs).
+    Fields that are unknown are left out, so the metadata can be stored as is.
+    """
+    chunks = iterative_chunking(md_text, max_size, max_tokens, encoding_name)
+
+    # the header path in effect after every header
+    header_positions, header_paths = [], []
+    path = []
+    for match in re.finditer(r'^(#{1,6}) +(.+?) *#* *$', md_text, flags=re.MULTILINE):
+        level = len(match.group(1))
+        path = path[:level - 1] + [''] * (level - 1 - len(path)) + [match.group(2).strip()]
+        header_positions.append(match.start())
+        header_paths.append(' > '.join(header for header in path if header))
+    page_breaks = [match.start() for match in re.finditer('\f', md_text)]
+
+    records = []
+    for chunk, (start, end) in zip(chunks, chunk_offsets(md_text, chunks)):
+        metadata = {}
+        if start != -1:
+            metadata['char_start'], metadata['char_end'] = start, end
+            header = bisect.bisect_right(header_positions, start) - 1
+            if header >= 0:
+                metadata['header_path'] = header_paths[header]
+            if len(page_breaks) > 0:
+                metadata['page_start'] = bisect.bisect_right(page_breaks, start) + 1
+                metadata['page_end'] = bisect.bisect_right(page_breaks, end - 1) + 1
+        records.append({'text': chunk, 'metadata': metadata})
+    return records
@@ -15,12 +15,33 @@ load_dotenv()
 def document_to_markdown(doc_filename: str) -> str:
     """
     Convert a document (docx, pptx, xlsx, pdf) to Markdown text.
+    The pages of a PDF are separated by form feeds, so chunks can tell which pages they come from.
     """
+    if os.path.splitext(doc_filename)[1].lower() == '.pdf':
+        pdf_text = pdf_to_text(doc_filename)
+        if pdf_text is not None:
+            return pdf_text
     mid = MarkItDown(enable_plugins=False)
     conversion = mid.convert(doc_filename)
     return conversion.text_content
 
 
+def pdf_to_text(pdf_filename: str):
+    """
+    Text of a PDF extracted page by page, with a form feed between pages
+    (MarkItDown may join pages with blank lines only). None when pdfminer is not installed.
+    """
+    try:
+        from pdfminer.high_level import extract_pages
+        from pdfminer.layout import LTTextContainer
+    except ImportError:
+        print('WARNING: pdfminer.six is not installed, PDF page numbers are not available')
+        return None
+    pages = [''.join(element.get_text() for element in page if isinstance(element, LTTextContainer))
+             for page in extract_pages(pdf_filename)]
+    return '\f'.join(pages)
+
+
 def image_description(img_filename: str) -> str:
     """
     Generate a Markdown image description using an LLM client.
@@ -0,0 +1,177 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+
+# words, plus compound codes such as 'AB-123/2024' or 'art.5.2' (the parts of a code are indexed as well)
+TOKEN_PATTERN = re.compile(r'\w+(?:[-./]\w+)*')
+
+
+def tokenize(text: str) -> list[str]:
+    tokens = []
+    for token in TOKEN_PATTERN.findall(text.lower()):
+        tokens.append(token)
+        if not token.isalnum():
+            tokens.extend(re.findall(r'\w+', token))
+    return tokens
+
+
+class BM25Index:
+    """
+    Inverted index for lexical (BM25) search over the stored chunks.
+    Postings are kept in memory for fast lookups, and every change is also written to an SQLite file,
+    so the index is updated incrementally instead of being rebuilt.
+    When another process changes the SQLite file, the postings are read again before the next lookup or change.
+    A chunk is identified by the name of the Chroma collection holding it and its id in there.
+    """
+
+    def __init__(self, path: str = None, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.path = path
+        self._lock = threading.Lock()
+
+        self.postings = {}  # term -> {chunk key: term frequency}
+        self.chunks = {}  # chunk key -> (document name, collection name, chunk id, length)
+        self.document_chunks = {}  # document name -> set of chunk keys
+        self.total_length = 0
+
+        self.connection = sqlite3.connect(path or ':memory:', check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS chunks '
+                                '(chunk_key TEXT PRIMARY KEY, document TEXT, collection TEXT, chunk_id TEXT, '
+                                'length INTEGER)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS postings (term TEXT, chunk_key TEXT, tf INTEGER)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS postings_chunk_key ON postings (chunk_key)')
+        self.connection.commit()
+        self._loaded_mtime = None
+        self._refresh()
+
+    @staticmethod
+    def chunk_key(collection_name: str, chunk_id: str) -> str:
+        return f'{collection_name}\x1f{chunk_id}'
+
+    def _file_mtime(self):
+        return None if self.path is None else os.path.getmtime(self.path)
+
+    def _refresh(self):
+        """Read the postings again when the file changed since they were last read (call while holding the lock)."""
+        if self._loaded_mtime is not None and (self.path is None or self._file_mtime() == self._loaded_mtime):
+            return
+        self.postings = {}
+        self.chunks = {}
+        self.document_chunks = {}
+        self.total_length = 0
+        self._load()
+        self._loaded_mtime = self._file_mtime() or 0
+
+    def _written(self):
+        if self.path is not None:
+            self._loaded_mtime = self._file_mtime()  # our own change is already in memory
+
+    def _load(self):
+        for chunk_key, document, collection, chunk_id, length in self.connection.execute('SELECT * FROM chunks'):
+            self.chunks[chunk_key] = (document, collection, chunk_id, length)
+            self.document_chunks.setdefault(document, set()).add(chunk_key)
+            self.total_length += length
+        for term, chunk_key, tf in self.connection.execute('SELECT term, chunk_key, tf FROM postings'):
+            self.postings.setdefault(term, {})[chunk_key] = tf
+
+    def add_chunks(self, document_name: str, collection_name: str, chunk_ids: list[str], chunks: list[str]):
+        chunk_rows, posting_rows = [], []
+        with self._lock:
+            self._refresh()
+            for chunk_id, chunk in zip(chunk_ids, chunks):
+                chunk_key = self.chunk_key(collection_name, chunk_id)
+                if chunk_key in self.chunks:
+                    self._remove_chunk(chunk_key)
+                tokens = tokenize(chunk)
+                self.chunks[chunk_key] = (document_name, collection_name, chunk_id, len(tokens))
+                self.document_chunks.setdefault(document_name, set()).add(chunk_key)
+                self.total_length += len(tokens)
+                chunk_rows.append((chunk_key, document_name, collection_name, chunk_id, len(tokens)))
+
+                for term, tf in Counter(tokens).items():
+                    self.postings.setdefault(term, {})[chunk_key] = tf
+                    posting_rows.append((term, chunk_key, tf))
+
+            self.connection.executemany('INSERT OR REPLACE INTO chunks VALUES (?, ?, ?, ?, ?)', chunk_rows)
+            self.connection.executemany('INSERT INTO postings VALUES (?, ?, ?)', posting_rows)
+            self.connection.commit()
+            self._written()
+
+    def remove_chunks(self, collection_name: str, chunk_ids: list[str]):
+        with self._lock:
+            self._refresh()
+            for chunk_id in chunk_ids:
+                chunk_key = self.chunk_key(collection_name, chunk_id)
+                if chunk_key in self.chunks:
+                    self._remove_chunk(chunk_key)
+            self.connection.commit()
+            self._written()
+
+    def remove_document(self, document_name: str):
+        with self._lock:
+            self._refresh()
+            for chunk_key in list(self.document_chunks.get(document_name, [])):
+                self._remove_chunk(chunk_key)
+            self.document_chunks.pop(document_name, None)
+            self.connection.commit()
+            self._written()
+
+    def document_chunk_counts(self) -> dict:
+        """Number of indexed chunks of every indexed document."""
+        with self._lock:
+            self._refresh()
+            return {document: len(chunk_keys) for document, chunk_keys in self.document_chunks.items()
+                    if len(chunk_keys) > 0}
+
+    def document_collections(self) -> dict:
+        """Names of the collections the indexed chunks of every indexed document point to."""
+        with self._lock:
+            self._refresh()
+            return {document: {self.chunks[chunk_key][1] for chunk_key in chunk_keys}
+                    for document, chunk_keys in self.document_chunks.items() if len(chunk_keys) > 0}
+
+    def _remove_chunk(self, chunk_key: str):
+        document, _, _, length = self.chunks.pop(chunk_key)
+        self.document_chunks.get(document, set()).discard(chunk_key)
+        self.total_length -= length
+
+        terms = [row[0] for row in self.connection.execute('SELECT term FROM postings WHERE chunk_key = ?',
+                                                           (chunk_key,))]
+        for term in terms:
+            term_postings = self.postings.get(term, {})
+            term_postings.pop(chunk_key, None)
+            if len(term_postings) == 0:
+                self.postings.pop(term, None)
+        self.connection.execute('DELETE FROM postings WHERE chunk_key = ?', (chunk_key,))
+        self.connection.execute('DELETE FROM chunks WHERE chunk_key = ?', (chunk_key,))
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def search(self, query: str, amount: int = 5) -> list[tuple]:
+        """Return (collection name, chunk id, score) for the best matching chunks, best first."""
+        with self._lock:
+            self._refresh()
+            chunk_count = len(self.chunks)
+            if chunk_count == 0:
+                return []
+            average_length = self.total_length / chunk_count
+
+            scores = Counter()
+            for term in set(tokenize(query)):
+                term_postings = self.postings.get(term)
+                if not term_postings:
+                    continue
+                idf = math.log(1 + (chunk_count - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+                for chunk_key, tf in term_postings.items():
+                    length = self.chunks[chunk_key][3]
+                    norm = self.k1 * (1 - self.b + self.b * length / average_length)
+                    scores[chunk_key] += idf * tf * (self.k1 + 1) / (tf + norm)
+
+            return [(self.chunks[chunk_key][1], self.chunks[chunk_key][2], score)
+                    for chunk_key, score in scores.most_common(amount)]
@@ -1,87 +1,1048 @@
+import hashlib
+import heapq
+import json
+import os
 import sys
+import time
+import zlib
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, TimeoutError
+from itertools import islice
+from urllib.parse import urlparse
 
 import chromadb
+import numpy as np
 from chromadb import QueryResult
+from chromadb.config import DEFAULT_DATABASE, Settings
+from chromadb.errors import NotFoundError
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
 from tqdm import tqdm
 
 sys.path.append('../')
 sys.path.append('../../demos/')
 
 from components.text_utils.string_utils import clean_up_string
+from components.vectorstore.bm25_index import BM25Index
+from components.vectorstore.document_catalog import CatalogEntryBuilder, DocumentCatalog, catalog_entry
+from components.vectorstore.embedding_cache import EmbeddingCache, embedding_model_id
+from components.vectorstore.lru_cache import LRUCache
+from components.vectorstore.metadata_filter import checked_filters, filter_values, split_document_filter
+from components.vectorstore.mmr import mmr_select
 
+EMBEDDING_CACHE_FILE = 'embedding_cache.sqlite3'
+LEXICAL_INDEX_FILE = 'lexical_index.sqlite3'
+CATALOG_FILE = 'document_catalog.sqlite3'
+# collection holding the progress of every unfinished ingest, one record per document (the id is the document name);
+# document names only contain a-z, 0-9 and dashes, so it cannot clash with the collection of a document
+INGEST_MARKER_COLLECTION = 'ingest_markers'
 
-def repack_query_results(results: QueryResult):
-    # not included in mapping: 'uris', 'embeddings', 'data' , 'included'
-    fields = ['ids', 'distances', 'metadatas', 'documents']
-    length = len(results['ids'][0])  # ids are always returned
+# collections holding the chunks of all documents (shared layout) are named '<prefix><shard number>'
+SHARED_COLLECTION_PREFIX = 'shared-documents-shard-'
+
+# chunk metadata that changes with every upload; update_document keeps the stored value of unchanged chunks
+VOLATILE_METADATA_KEYS = ['uploaded_at']
+
+
+def repack_query_results(results: QueryResult, query_index: int = 0):
+    # not included in mapping: 'uris', 'data' , 'included'
+    fields = ['ids', 'distances', 'metadatas', 'documents', 'embeddings']
+    length = len(results['ids'][query_index])  # ids are always returned
     repacked = []
     for r in range(length):
         repacked_result = {}
         for field in fields:
-            if results[field] is not None:
-                repacked_result[field[:-1]] = results[field][0][r]
+            if results.get(field) is not None:
+                repacked_result[field[:-1]] = results[field][query_index][r]
         repacked.append(repacked_result)
     return repacked
 
 
+def reciprocal_rank_fusion(rankings: list[list], rrf_k: int = 60) -> Counter:
+    """Fuse several rankings (lists of keys, best first) into one score per key, higher is better."""
+    fused_scores = Counter()
+    for ranking in rankings:
+        for rank, key in enumerate(ranking):
+            fused_scores[key] += 1 / (rrf_k + rank + 1)
+    return fused_scores
+
+
+def pack_strings(strings: list[str]):
+    """Pack strings into one UTF-8 byte array plus the end offset of every string (a compact column)."""
+    encoded = [string.encode('utf-8') for string in strings]
+    offsets = np.cumsum([len(e) for e in encoded], dtype=np.int64)
+    return np.frombuffer(b''.join(encoded), dtype=np.uint8), offsets
+
+
+def unpack_strings(blob: np.ndarray, offsets: np.ndarray) -> list[str]:
+    data = blob.tobytes()
+    starts = [0] + offsets[:-1].tolist()
+    return [data[start:end].decode('utf-8') for start, end in zip(starts, offsets.tolist())]
+
+
+def link_neighbors(meta_infos: list) -> list:
+    """Record the ids of the previous and next chunk (in document order) in the metadata of every chunk."""
+    linked = []
+    for c, meta_info in enumerate(meta_infos):
+        meta_info = {key: value for key, value in meta_info.items() if key not in ['previous_id', 'next_id']}
+        if c > 0:
+            meta_info['previous_id'] = meta_infos[c - 1]['id']
+        if c < len(meta_infos) - 1:
+            meta_info['next_id'] = meta_infos[c + 1]['id']
+        linked.append(meta_info)
+    return linked
+
+
+def document_order(meta_infos: list) -> list:
+    """
+    Indexes of stored chunks in document order, following the next_id links from the first chunk
+    (Chroma does not return chunks in document order once a document was updated).
+    Chunks that are not reached this way follow in the order they were given.
+    """
+    index_by_id = {meta_info['id']: i for i, meta_info in enumerate(meta_infos)}
+    order, seen = [], set()
+    for i, meta_info in enumerate(meta_infos):
+        if 'previous_id' in meta_info:
+            continue
+        while i is not None and i not in seen:
+            order.append(i)
+            seen.add(i)
+            i = index_by_id.get(meta_infos[i].get('next_id'))
+    return order + [i for i in range(len(meta_infos)) if i not in seen]
+
+
+def link_neighbors_stream(chunks_with_meta_infos):
+    """link_neighbors for a stream of (chunk, meta_info) pairs, looking one chunk ahead."""
+    previous, previous_id = None, None
+    for chunk, meta_info in chunks_with_meta_infos:
+        if previous is not None:
+            yield previous[0], _linked(previous[1], previous_id, meta_info['id'])
+            previous_id = previous[1]['id']
+        previous = (chunk, meta_info)
+    if previous is not None:
+        yield previous[0], _linked(previous[1], previous_id, None)
+
+
+def _linked(meta_info: dict, previous_id, next_id) -> dict:
+    meta_info = {key: value for key, value in meta_info.items() if key not in ['previous_id', 'next_id']}
+    if previous_id is not None:
+        meta_info['previous_id'] = previous_id
+    if next_id is not None:
+        meta_info['next_id'] = next_id
+    return meta_info
+
+
+def batched(iterable, batch_size: int):
+    """Lists of batch_size items (the last one can be shorter) taken from an iterable."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, batch_size)):
+        yield batch
+
+
+def chunk_hash(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+
+
+def shard_collection_name(document_name: str, shard_count: int) -> str:
+    """
+    Name of the shared collection that holds the chunks of a document.
+    Uses a stable hash, so a document always lands in the same shard.
+    """
+    shard = zlib.crc32(document_name.encode('utf-8')) % shard_count
+    return f'{SHARED_COLLECTION_PREFIX}{shard}'
+
+
+def chroma_server_client(server_url: str, database: str = None, max_connections: int = 16):
+    """
+    HttpClient for a (local) Chroma server, e.g. started with `chroma run --path <store> --port 8000`.
+    Requests share a pool of max_connections keep-alive connections.
+    A database other than the default one is created when it does not exist yet.
+    """
+    url = urlparse(server_url)
+    ssl = url.scheme == 'https'
+    port = url.port or (443 if ssl else 8000)
+    if database is not None:
+        admin_client = chromadb.AdminClient(Settings(chroma_api_impl='chromadb.api.fastapi.FastAPI',
+                                                     chroma_server_host=url.hostname,
+                                                     chroma_server_http_port=port,
+                                                     chroma_server_ssl_enabled=ssl))
+        try:
+            admin_client.get_database(database)
+        except NotFoundError:
+            admin_client.create_database(database)
+    settings = Settings(chroma_http_max_connections=max_connections,
+                        chroma_http_max_keepalive_connections=max_connections)
+    return chromadb.HttpClient(host=url.hostname, port=port, ssl=ssl, settings=settings,
+                               database=database or DEFAULT_DATABASE)
+
+
 class ChromaDocumentStore:
     cdb_client: chromadb.ClientAPI
 
-    def __init__(self, path=None):
-        if path is None:
+    def __init__(self, path=None,
+                 shared_collection: bool = False,
+                 shard_count: int = 1,
+                 embedding_function=None,
+                 query_cache_size: int = 128,
+                 insert_batch_size: int = 64,
+                 query_workers: int = 1,
+                 query_deadline: float = None,
+                 embedding_cache_size_mb: float = 256,
+                 lexical_index: bool = False,
+                 result_cache_size: int = 256,
+                 result_cache_ttl: float = 600,
+                 hnsw_config: dict = None,
+                 server_url: str = None,
+                 database: str = None,
+                 server_connections: int = 16):
+        """
+        By default, every document gets its own collection.
+        With shared_collection=True, all chunks are kept in a fixed number of shared collections (shards),
+        tagged with their document name, so a query does not fan out over every document.
+        Queries are embedded once by the store (not by every collection), recent query embeddings are cached.
+        Documents are embedded and written in batches of insert_batch_size chunks.
+        With query_workers > 1, collections are queried concurrently on a bounded thread pool.
+        When query_deadline (in seconds) is set, a query returns the best results gathered before the deadline.
+        On disk, chunk embeddings are cached (by content hash) in the store folder, so re-uploads are not embedded again.
+        With lexical_index=True, a BM25 index is kept next to the store, enabling hybrid queries.
+        Query results are cached for result_cache_ttl seconds, until a document is added, updated or removed.
+        hnsw_config sets the HNSW index parameters of new collections, e.g.
+        {'space': 'cosine', 'ef_construction': 200, 'ef_search': 100, 'max_neighbors': 16}
+        (max_neighbors is HNSW's M, see hnsw_benchmark.py to pick values for a corpus); None keeps Chroma's defaults.
+        With server_url (e.g. 'http://localhost:8000'), the store is kept by a Chroma server instead of in path,
+        so several processes can share it; path then holds the embedding cache, the lexical index and a local copy
+        of the document catalog, which is refreshed from the server when the store is opened.
+        database selects a separate database on that server.
+        """
+        self.server_url = server_url
+        if server_url is not None:
+            self.cdb_client = chroma_server_client(server_url, database, server_connections)  # client/server
+            if path is not None:
+                os.makedirs(path, exist_ok=True)
+        elif path is None:
             print('WARNING: using in-memory ChromaDB, no persistence!')
             self.cdb_client = chromadb.Client()  # in memory
         else:
             self.cdb_client = chromadb.PersistentClient(path=path)  # on disk
 
+        self.shared_collection = shared_collection
+        self.shard_count = max(1, shard_count)
+
+        if embedding_function is None:
+            embedding_function = DefaultEmbeddingFunction()
+        self.embedding_function = embedding_function
+        self.query_embeddings = LRUCache(max_size=query_cache_size)
+        self.query_results = LRUCache(max_size=result_cache_size, ttl=result_cache_ttl)
+
+        self.embedding_cache = None
+        if path is not None and embedding_cache_size_mb > 0:
+            self.embedding_cache = EmbeddingCache(os.path.join(path, EMBEDDING_CACHE_FILE),
+                                                  model_id=embedding_model_id(embedding_function),
+                                                  max_size_mb=embedding_cache_size_mb)
+
+        # name, source, hash, size and ingest time of every stored document, so listing does not touch Chroma
+        self.catalog = DocumentCatalog(None if path is None else os.path.join(path, CATALOG_FILE))
+        if server_url is not None:
+            self.refresh_catalog()  # other processes (and hosts) write to the same server
+        elif len(self.catalog) == 0:
+            self.rebuild_catalog()
+
+        self.lexical_index = None
+        if lexical_index:
+            index_path = None if path is None else os.path.join(path, LEXICAL_INDEX_FILE)
+            self.lexical_index = BM25Index(index_path)
+            self.sync_lexical_index()
+
+        self.hnsw_config = hnsw_config
+        self.insert_batch_size = max(1, min(insert_batch_size, self.cdb_client.get_max_batch_size()))
+
+        self.query_deadline = query_deadline
+        self.query_pool = None
+        if query_workers > 1:
+            self.query_pool = ThreadPoolExecutor(max_workers=query_workers, thread_name_prefix='query_store')
+
+    def _create_collection(self, collection_name: str, get_or_create: bool = False):
+        """Create a collection with the configured HNSW index parameters."""
+        configuration = None if self.hnsw_config is None else {'hnsw': self.hnsw_config}
+        return self.cdb_client.create_collection(collection_name,
+                                                 configuration=configuration,
+                                                 embedding_function=self.embedding_function,
+                                                 get_or_create=get_or_create)
+
+    def _shard_collection(self, document_name: str):
+        return self._create_collection(shard_collection_name(document_name, self.shard_count), get_or_create=True)
+
+    def embed_query(self, query: str):
+        """Embed a query string, reusing the embedding of recently seen queries."""
+        return self.embed_queries([query])[0]
+
+    def embed_queries(self, queries: list[str]):
+        """Embed several query strings, running the embedding model once for all queries that are not cached."""
+        embeddings = [self.query_embeddings.get(query) for query in queries]
+        missing = [q for q, embedding in enumerate(embeddings) if embedding is None]
+        if len(missing) > 0:
+            computed = self.embedding_function([queries[q] for q in missing])
+            for q, embedding in zip(missing, computed):
+                embeddings[q] = embedding
+                self.query_embeddings.put(queries[q], embedding)
+        return embeddings
+
+    def embed_documents(self, chunks: list[str]):
+        """Embed a batch of chunk texts, only running the embedding model for chunks that are not cached."""
+        if self.embedding_cache is None:
+            return self.embedding_function(chunks)
+
+        embeddings = self.embedding_cache.get_many(chunks)
+        missing = [c for c, embedding in enumerate(embeddings) if embedding is None]
+        if len(missing) > 0:
+            missing_chunks = [chunks[c] for c in missing]
+            computed = self.embedding_function(missing_chunks)
+            for c, embedding in zip(missing, computed):
+                embeddings[c] = embedding
+            self.embedding_cache.put_many(missing_chunks, computed)
+        return embeddings
+
+    def rebuild_lexical_index(self):
+        """(Re)index all stored chunks in the lexical index, e.g. for a store created without one."""
+        self._index_documents()
+
+    def sync_lexical_index(self):
+        """
+        Bring the lexical index in line with the catalog: documents that are missing from the index
+        (or indexed with a different number of chunks, or in another collection) are indexed again,
+        documents that are gone are dropped.
+        This catches up with documents written while the index was not kept, e.g. by another process.
+        """
+        indexed_counts = self.lexical_index.document_chunk_counts()
+        indexed_collections = self.lexical_index.document_collections()
+        stored_counts = {entry['name']: entry['chunk_count'] for entry in self.catalog.entries()}
+        for document_name in set(indexed_counts) - set(stored_counts):
+            self.lexical_index.remove_document(document_name)
+        # chunks indexed under another collection (e.g. after migrate_to_shared_store.py) are never found
+        stale_documents = {name for name, chunk_count in stored_counts.items()
+                           if indexed_counts.get(name) != chunk_count
+                           or indexed_collections.get(name) != {self._collection_name(name)}}
+        if len(stale_documents) > 0:
+            self._index_documents(stale_documents)
+
+    def _index_documents(self, document_names: set = None):
+        """Index the stored chunks of document_names (all documents when None) in the lexical index."""
+        where = None
+        if self.shared_collection and document_names is not None:
+            where = {'document': {'$in': sorted(document_names)}}
+        for collection in self._searchable_collections(document_names):
+            contents = collection.get(where=where, include=['documents', 'metadatas'])
+            ids_by_document = {}
+            for chunk_id, chunk, meta_info in zip(contents['ids'], contents['documents'], contents['metadatas']):
+                document_name = meta_info.get('document', collection.name)
+                ids_by_document.setdefault(document_name, ([], []))
+                ids_by_document[document_name][0].append(chunk_id)
+                ids_by_document[document_name][1].append(chunk)
+            for document_name, (chunk_ids, chunks) in ids_by_document.items():
+                self.lexical_index.remove_document(document_name)
+                self.lexical_index.add_chunks(document_name, collection.name, chunk_ids, chunks)
+
+    def rebuild_catalog(self):
+        """(Re)build the document catalog from the stored chunks, e.g. for a store created before the catalog."""
+        self.catalog.replace_all(self._catalog_entries())
+
+    def refresh_catalog(self):
+        """
+        Add the completely stored documents that are missing from the catalog and drop the ones that are gone,
+        e.g. for a store on a Chroma server that other processes write to.
+        """
+        stored_names = self._stored_document_names()
+        cataloged_names = set(self.catalog.names())
+        for document_name in cataloged_names - stored_names:
+            self.catalog.remove(document_name)
+        missing_names = stored_names - cataloged_names
+        if len(missing_names) > 0:
+            for entry in self._catalog_entries(missing_names):
+                self.catalog.put(entry)
+
+    def _stored_document_names(self) -> set:
+        """Names of the completely stored documents, read from Chroma."""
+        collections = self._searchable_collections()
+        if self.shared_collection:
+            document_names = {meta_info['document']
+                              for collection in collections
+                              for meta_info in collection.get(include=['metadatas'])['metadatas']}
+        else:
+            document_names = {collection.name for collection in collections if collection.count() > 0}
+        return document_names - self._partial_documents()
+
+    def _in_catalog(self, document_name: str) -> bool:
+        """
+        Whether a document is stored. On a Chroma server, a complete document stored by another process
+        is looked up there and added to the catalog; a local store only checks its catalog.
+        """
+        if document_name in self.catalog:
+            return True
+        if self.server_url is None:
+            return False
+        entries = self._catalog_entries({document_name})
+        if len(entries) == 0:
+            return False
+        self.catalog.put(entries[0])
+        return True
+
+    def _catalog_entries(self, document_names: set = None) -> list:
+        """Catalog entries of the completely stored documents (of document_names when given), read from Chroma."""
+        where = None
+        if self.shared_collection and document_names is not None:
+            where = {'document': {'$in': sorted(document_names)}}
+        entries = []
+        collections = self._searchable_collections(document_names)
+        partial_documents = self._partial_documents()
+        for collection in collections:
+            contents = collection.get(where=where, include=['documents', 'metadatas'])
+            chunks_by_document = {}
+            for chunk, meta_info in zip(contents['documents'], contents['metadatas']):
+                document_name = meta_info.get('document', collection.name)
+                chunks_by_document.setdefault(document_name, ([], []))
+                chunks_by_document[document_name][0].append(chunk)
+                chunks_by_document[document_name][1].append(meta_info)
+            for document_name, (chunks, meta_infos) in chunks_by_document.items():
+                if document_name in partial_documents:
+                    continue
+                # the ingest time is unknown, the time of the rebuild is used instead
+                entries.append(catalog_entry(document_name, chunks, meta_infos))
+        return entries
+
+    def _searchable_collections(self, document_names: set = None):
+        """The collections to query, only those that can hold chunks of document_names when given."""
+        collections = self.cdb_client.list_collections()
+        if self.shared_collection:
+            collections = [c for c in collections if c.name.startswith(SHARED_COLLECTION_PREFIX)]
+            if document_names is not None:
+                shards = {shard_collection_name(name, self.shard_count) for name in document_names}
+                collections = [c for c in collections if c.name in shards]
+            return collections
+        collections = [c for c in collections
+                       if not c.name.startswith(SHARED_COLLECTION_PREFIX) and c.name != INGEST_MARKER_COLLECTION]
+        if document_names is not None:
+            collections = [c for c in collections if c.name in document_names]
+        return collections
+
+    def _pushdown_filter(self, where: dict):
+        """
+        Split a `where` filter into the collections that can match it and the filter to pass on to Chroma.
+        A condition on the document name selects collections; in the per-document layout chunks are not tagged
+        with their document, so that condition is dropped from the filter itself.
+        A condition on the source selects the collections of the documents with that source in the catalog
+        (and stays in the filter).
+        Chunks of documents that are still being ingested are excluded.
+        """
+        document_names, rest = split_document_filter(where)
+        sources = filter_values(where, 'source')
+        if sources is not None:
+            source_documents = {entry['name'] for entry in self.catalog.entries() if entry['source'] in sources}
+            document_names = source_documents if document_names is None else document_names & source_documents
+        if self.shared_collection and where:
+            rest = where
+        collections = self._searchable_collections(document_names)
+
+        # documents that are not completely ingested are left out
+        partial_documents = self._partial_documents()
+        if len(partial_documents) > 0:
+            if self.shared_collection:
+                complete_only = {'document': {'$nin': sorted(partial_documents)}}
+                rest = complete_only if rest is None else {'$and': [rest, complete_only]}
+            else:
+                collections = [c for c in collections if c.name not in partial_documents]
+        return collections, rest
+
     def add_document(self, document_name: str,
                      chunks: list[str],
                      meta_infos: list,
                      tqdm_func=tqdm):
+        """
+        Embed and store the chunks of a new document.
+        chunks and meta_infos can also be iterators (e.g. from stream_chunking): the document is then embedded
+        and written batch by batch, without holding all of it in memory.
+        """
         collection_name = clean_up_string(document_name)
 
-        current_document_list = self.list_documents()
-        if collection_name in current_document_list:
+        if self._in_catalog(collection_name):
             print(f'A document with this name is already in the collection: {collection_name}')
             # self.remove_document(collection_name)
             return
+        if not isinstance(chunks, list):
+            self._add_document_stream(collection_name, chunks, meta_infos, tqdm_func)
+            return
+        entry = catalog_entry(collection_name, chunks, meta_infos)
+        duplicates = self.catalog.names_with_hash(entry['content_hash'])
+        if len(duplicates) > 0:
+            print(f'WARNING: {collection_name} has the same content as {", ".join(duplicates)}')
+
+        if self.shared_collection:
+            cdb_collection = self._shard_collection(collection_name)
+        else:
+            # a new collection for this document (or the one left behind by an interrupted ingest)
+            cdb_collection = self._create_collection(collection_name, get_or_create=True)
+
+        # chunks are committed in batches, each batch moves the progress marker of the document,
+        # so an interrupted ingest of the same content resumes after the last committed batch
+        marker = self._ingest_marker(collection_name)
+        done = 0
+        if marker is not None and marker['content_hash'] == entry['content_hash'] and marker['total'] == len(chunks):
+            done = marker['done']
+            print(f'Resuming the ingest of {collection_name} at chunk {done} of {len(chunks)}')
+        elif marker is not None:
+            self._remove_partial_document(cdb_collection, collection_name)
+        marker = {'content_hash': entry['content_hash'], 'total': len(chunks), 'done': done}
+        self._set_ingest_marker(collection_name, marker)
+
+        def checkpoint(end):
+            self._set_ingest_marker(collection_name, {**marker, 'done': done + end})
+
+        meta_infos = link_neighbors(meta_infos)
+        self._insert_chunks(cdb_collection, collection_name, chunks[done:], meta_infos[done:], tqdm_func,
+                            on_batch_written=checkpoint)
+        self._set_ingest_marker(collection_name, None)
+        self.catalog.put(entry)
+
+    def _add_document_stream(self, collection_name: str, chunks, meta_infos, tqdm_func=tqdm):
+        if self.shared_collection:
+            cdb_collection = self._shard_collection(collection_name)
+        else:
+            cdb_collection = self._create_collection(collection_name, get_or_create=True)
+
+        # the content hash is only known at the end, so an interrupted streamed ingest starts over
+        if self._ingest_marker(collection_name) is not None:
+            self._remove_partial_document(cdb_collection, collection_name)
+        self._set_ingest_marker(collection_name, {'content_hash': None, 'total': None, 'done': 0})
+
+        entry_builder = CatalogEntryBuilder(collection_name)
 
-        # create a new collection for this document
-        cdb_collection = self.cdb_client.create_collection(collection_name)
+        def cataloged(chunks_with_meta_infos):
+            for chunk, meta_info in chunks_with_meta_infos:
+                entry_builder.add(chunk, meta_info)
+                yield chunk, meta_info
 
-        taqaddum = tqdm_func(range(len(chunks)))
+        linked = link_neighbors_stream(cataloged(zip(chunks, meta_infos)))
+        batches = (([chunk for chunk, _ in batch], [meta_info for _, meta_info in batch], None)
+                   for batch in batched(linked, self.insert_batch_size))
+        self._insert_batches(cdb_collection, collection_name, batches, tqdm_func(total=None))
+        self._set_ingest_marker(collection_name, None)
+
+        entry = entry_builder.entry()
+        duplicates = self.catalog.names_with_hash(entry['content_hash'])
+        if len(duplicates) > 0:
+            print(f'WARNING: {collection_name} has the same content as {", ".join(duplicates)}')
+        self.catalog.put(entry)
+
+    def _marker_collection(self):
+        return self.cdb_client.get_or_create_collection(INGEST_MARKER_COLLECTION, embedding_function=None)
+
+    def _ingest_marker(self, document_name: str):
+        """Progress of an unfinished ingest of a document ({'content_hash', 'total', 'done'}), or None."""
+        records = self._marker_collection().get(ids=[document_name], include=['documents'])
+        return None if len(records['ids']) == 0 else json.loads(records['documents'][0])
+
+    def _set_ingest_marker(self, document_name: str, marker: dict = None):
+        # every document has its own marker record, so concurrent ingests do not overwrite each other's progress
+        marker_collection = self._marker_collection()
+        if marker is None:
+            marker_collection.delete(ids=[document_name])
+        else:
+            # the record is never searched, it gets a constant embedding
+            marker_collection.upsert(ids=[document_name], documents=[json.dumps(marker)], embeddings=[[1.0]])
+
+    def _remove_partial_document(self, cdb_collection, document_name: str):
+        """
+        Delete the chunks an interrupted ingest left behind.
+        Only call this when an ingest marker of the document proves that ingest did not complete:
+        in the per-document layout, every chunk of the collection is deleted.
+        """
+        where = {'document': document_name} if self.shared_collection else None
+        leftover_ids = cdb_collection.get(where=where, include=[])['ids']
+        if len(leftover_ids) == 0:
+            return
+        print(f'Removing {len(leftover_ids)} chunks of an interrupted ingest of {document_name}')
+        cdb_collection.delete(ids=leftover_ids)
+        if self.lexical_index is not None:
+            self.lexical_index.remove_document(document_name)
+
+    def _partial_documents(self) -> set:
+        """Names of the documents still being ingested (or interrupted)."""
+        return set(self._marker_collection().get(include=[])['ids'])
+
+    def update_document(self, document_name: str,
+                        chunks: list[str],
+                        meta_infos: list,
+                        tqdm_func=tqdm):
+        """
+        Bring a stored document up to date with a new list of chunks (adds the document if it is not stored yet).
+        Chunks are compared by content hash: unchanged chunks keep their ids and are not embedded again,
+        only new chunks are embedded and inserted, and chunks that disappeared are deleted.
+        Unchanged chunks whose metadata changed (e.g. neighbours or offsets) only get their metadata updated;
+        volatile keys (VOLATILE_METADATA_KEYS, e.g. uploaded_at) keep their stored value, so they tell when
+        the text of a chunk was first stored and a re-upload does not rewrite every chunk.
+        """
+        collection_name = clean_up_string(document_name)
+        if not self._in_catalog(collection_name):
+            self.add_document(collection_name, chunks, meta_infos, tqdm_func)
+            return
+
+        cdb_collection, where = self._document_collection(collection_name)
+        stored = cdb_collection.get(where=where, include=['documents', 'metadatas'])
+        # copies of a repeated text (e.g. a page footer) are matched in document order, so they keep their ids
+        stored_by_hash = {}
+        for i in document_order(stored['metadatas']):
+            stored_by_hash.setdefault(chunk_hash(stored['documents'][i]), deque()).append(
+                (stored['ids'][i], stored['metadatas'][i]))
+        taken_ids = {meta_info['id'] for meta_info in stored['metadatas']}
+
+        # decide the id of every chunk first (kept or new), so neighbours can be linked in the new order
+        kept_chunks, final_meta_infos = [], []
+        for chunk, meta_info in zip(chunks, meta_infos):
+            digest = chunk_hash(chunk)
+            if len(stored_by_hash.get(digest, [])) > 0:
+                kept_chunk = stored_by_hash[digest].popleft()  # unchanged chunk, keeps its id and embedding
+                kept_chunks.append(kept_chunk)
+                final_meta_infos.append({**meta_info, 'id': kept_chunk[1]['id']})
+                continue
+            new_id = f'chunk_{digest[:16]}'
+            while new_id in taken_ids:
+                new_id += '_'  # identical text occurring more than once
+            taken_ids.add(new_id)
+            kept_chunks.append(None)
+            final_meta_infos.append({**meta_info, 'id': new_id})
+        final_meta_infos = link_neighbors(final_meta_infos)
+
+        new_chunks, new_meta_infos = [], []
+        changed_ids, changed_meta_infos = [], []
+        for chunk, meta_info, kept_chunk in zip(chunks, final_meta_infos, kept_chunks):
+            if kept_chunk is None:
+                new_chunks.append(chunk)
+                new_meta_infos.append(meta_info)
+                continue
+            chunk_id, stored_meta_info = kept_chunk
+            if self.shared_collection:
+                meta_info = {**meta_info, 'document': collection_name}
+            meta_info = {**meta_info, **{key: stored_meta_info[key] for key in VOLATILE_METADATA_KEYS
+                                         if key in stored_meta_info and key in meta_info}}
+            if meta_info != stored_meta_info:
+                # metadata updates are merged, None removes a key that is no longer used
+                changed_ids.append(chunk_id)
+                changed_meta_infos.append({**{key: None for key in stored_meta_info}, **meta_info})
+
+        vanished_ids = [chunk_id for kept in stored_by_hash.values() for chunk_id, _ in kept]
+        if len(vanished_ids) > 0:
+            cdb_collection.delete(ids=vanished_ids)
+            self.query_results.clear()
+            if self.lexical_index is not None:
+                self.lexical_index.remove_chunks(cdb_collection.name, vanished_ids)
+        if len(changed_ids) > 0:
+            cdb_collection.update(ids=changed_ids, metadatas=changed_meta_infos)
+            self.query_results.clear()
+        self._insert_chunks(cdb_collection, collection_name, new_chunks, new_meta_infos, tqdm_func)
+        self.catalog.put(catalog_entry(collection_name, chunks, meta_infos))
+        print(f'Updated {collection_name}: {len(new_chunks)} chunks added, {len(changed_ids)} relinked, '
+              f'{len(vanished_ids)} removed')
+
+    def _collection_name(self, document_name: str) -> str:
+        """Name of the collection holding the chunks of a document."""
+        if self.shared_collection:
+            return shard_collection_name(document_name, self.shard_count)
+        return document_name
+
+    def _document_collection(self, collection_name: str):
+        """Return the collection holding a document, and the filter that selects its chunks in there."""
+        if self.shared_collection:
+            return self._shard_collection(collection_name), {'document': collection_name}
+        return self.cdb_client.get_collection(collection_name, embedding_function=self.embedding_function), None
+
+    def _insert_chunks(self, cdb_collection, collection_name: str,
+                       chunks: list[str],
+                       meta_infos: list,
+                       tqdm_func=tqdm,
+                       embeddings=None,
+                       on_batch_written=None):
+        """
+        Write chunks to a collection, embedding them first unless their embeddings are given.
+        Batches are committed in order; after each one, on_batch_written is called with the number of chunks written.
+        """
+        batch_size = self.insert_batch_size if embeddings is None else self.cdb_client.get_max_batch_size()
+        batches = ((chunks[start:start + batch_size],
+                    meta_infos[start:start + batch_size],
+                    None if embeddings is None else embeddings[start:start + batch_size])
+                   for start in range(0, len(chunks), batch_size))
+        self._insert_batches(cdb_collection, collection_name, batches, tqdm_func(total=len(chunks)),
+                             on_batch_written)
+
+    def _insert_batches(self, cdb_collection, collection_name: str, batches, taqaddum, on_batch_written=None):
+        """Write batches of (chunks, meta_infos, embeddings or None) to a collection, see _insert_chunks."""
         taqaddum.set_description(desc=collection_name)
-        for c in taqaddum:
-            # add each chunk with its metadata
-            cdb_collection.add(
-                documents=chunks[c],
-                ids=meta_infos[c]['id'],
-                metadatas=meta_infos[c]
-            )
+        written = 0
+
+        def batch_written(write):
+            nonlocal written
+            future, ids, chunks = write
+            taqaddum.update(future.result())
+            if self.lexical_index is not None:
+                self.lexical_index.add_chunks(collection_name, cdb_collection.name, ids, chunks)
+            written += len(ids)
+            if on_batch_written is not None:
+                on_batch_written(written)
+
+        # embed the next batch while the previous one is being written (at most one batch in flight)
+        with ThreadPoolExecutor(max_workers=1) as writer:
+            pending_write = None
+            for chunks, meta_infos, embeddings in batches:
+                if self.shared_collection:
+                    # tag each chunk with its document, and make the ids unique within the shard
+                    meta_infos = [{**meta_info, 'document': collection_name} for meta_info in meta_infos]
+                    ids = [f'{collection_name}/{meta_info["id"]}' for meta_info in meta_infos]
+                else:
+                    ids = [meta_info['id'] for meta_info in meta_infos]
+                if embeddings is None:
+                    embeddings = self.embed_documents(chunks)
+
+                if pending_write is not None:
+                    batch_written(pending_write)
+                pending_write = (writer.submit(self._write_batch, cdb_collection, ids, chunks, meta_infos, embeddings),
+                                 ids, chunks)
+
+            if pending_write is not None:
+                batch_written(pending_write)
+        taqaddum.close()
+        self.query_results.clear()
+
+    @staticmethod
+    def _write_batch(cdb_collection, ids, chunks, meta_infos, embeddings):
+        # upsert: a resumed ingest may write the batch that was in flight when it was interrupted once more
+        cdb_collection.upsert(
+            ids=ids,
+            documents=chunks,
+            metadatas=meta_infos,
+            embeddings=embeddings
+        )
+        return len(ids)
 
     def remove_document(self, document_name):
-        self.cdb_client.delete_collection(document_name)
+        if self.shared_collection:
+            shard = self._shard_collection(document_name)
+            shard.delete(where={'document': document_name})
+        else:
+            self.cdb_client.delete_collection(document_name)
+        self._set_ingest_marker(document_name, None)
+        self.query_results.clear()
+        if self.lexical_index is not None:
+            self.lexical_index.remove_document(document_name)
+        self.catalog.remove(document_name)
 
     def list_documents(self):
-        collections = self.cdb_client.list_collections()
-        collection_names = []
-        for collection in collections:
-            collection_names.append(collection.name)
-        collection_names.sort()
-        return collection_names
+        return self.catalog.names()
 
-    def query_store(self, query: str, amount: int = 5):
-        all_results: list = []
+    def document_catalog(self) -> list:
+        """Name, source, content hash, chunk count, size in bytes and ingest time of every stored document."""
+        return self.catalog.entries()
 
-        collections = self.cdb_client.list_collections()
-        for collection in collections:
+    def close(self):
+        """Release the Chroma client, the query threads and the cache and index files (the store is unusable after)."""
+        if self.query_pool is not None:
+            self.query_pool.shutdown(wait=True)
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+        if self.lexical_index is not None:
+            self.lexical_index.close()
+        self.catalog.close()
+        self.query_embeddings.clear()
+        self.query_results.clear()
+        self.cdb_client.close()
+
+    def export_snapshot(self, snapshot_file: str):
+        """
+        Write all documents (ids, texts, metadata and embeddings) to one compressed .npz file,
+        so a new store can be filled with import_snapshot() without embedding anything again.
+        Every document is stored as a few columns: an embedding matrix, and UTF-8 blobs with offsets for the rest.
+        """
+        columns = {}
+        document_names = self.list_documents()
+        for d, document_name in enumerate(tqdm(document_names, desc='export')):
+            cdb_collection, where = self._document_collection(document_name)
+            contents = cdb_collection.get(where=where, include=['documents', 'metadatas', 'embeddings'])
+            columns[f'{d}_embeddings'] = np.asarray(contents['embeddings'], dtype=np.float32)
+            columns[f'{d}_documents'], columns[f'{d}_document_offsets'] = pack_strings(contents['documents'])
+            metadatas = [json.dumps(meta_info) for meta_info in contents['metadatas']]
+            columns[f'{d}_metadatas'], columns[f'{d}_metadata_offsets'] = pack_strings(metadatas)
+
+        columns['document_names'], columns['document_name_offsets'] = pack_strings(document_names)
+        np.savez_compressed(snapshot_file, **columns)
+        print(f'Exported {len(document_names)} documents to {snapshot_file}')
+
+    def import_snapshot(self, snapshot_file: str, tqdm_func=tqdm):
+        """Bulk-load the documents of a snapshot (see export_snapshot), using the embeddings stored in there."""
+        with np.load(snapshot_file) as snapshot:
+            document_names = unpack_strings(snapshot['document_names'], snapshot['document_name_offsets'])
+            for d, document_name in enumerate(document_names):
+                if self._in_catalog(document_name):
+                    print(f'A document with this name is already in the collection: {document_name}')
+                    continue
+
+                chunks = unpack_strings(snapshot[f'{d}_documents'], snapshot[f'{d}_document_offsets'])
+                metadatas = unpack_strings(snapshot[f'{d}_metadatas'], snapshot[f'{d}_metadata_offsets'])
+                meta_infos = [json.loads(meta_info) for meta_info in metadatas]
+                entry = catalog_entry(document_name, chunks, meta_infos)
+                if self.shared_collection:
+                    cdb_collection = self._shard_collection(document_name)
+                else:
+                    # the collection left behind by an interrupted ingest (or import) is reused
+                    cdb_collection = self._create_collection(document_name, get_or_create=True)
+                if self._ingest_marker(document_name) is not None:
+                    self._remove_partial_document(cdb_collection, document_name)
+                # marked like an ingest, so an interrupted import is not taken for a complete document
+                self._set_ingest_marker(document_name,
+                                        {'content_hash': entry['content_hash'], 'total': len(chunks), 'done': 0})
+                self._insert_chunks(cdb_collection, document_name, chunks, meta_infos, tqdm_func,
+                                    embeddings=snapshot[f'{d}_embeddings'])
+                self._set_ingest_marker(document_name, None)
+                self.catalog.put(entry)
+        print(f'Imported {len(document_names)} documents from {snapshot_file}')
+
+    def query_store(self, query: str, amount: int = 5, hybrid: bool = False,
+                    mmr_lambda: float = None, fetch_k: int = 20, neighbors: int = 0,
+                    where: dict = None, where_document: dict = None):
+        """
+        Return the chunks closest to the query, over all documents.
+        With hybrid=True, the vector ranking is fused with the lexical (BM25) ranking using reciprocal rank fusion,
+        which helps for exact codes and form numbers that embeddings tend to miss.
+        With mmr_lambda set, fetch_k candidates are reranked with maximal marginal relevance (see mmr_select),
+        so near-copies (overlapping chunks, duplicate documents) do not fill up the results.
+        With neighbors > 0, the text of every hit is extended with that many chunks before and after it.
+        where and where_document are Chroma filters on the chunk metadata and text, e.g.
+        {'source': 'manual.pdf'} or {'uploaded_at': {'$gte': timestamp}}, and {'$contains': 'ISO 9001'}.
+        They are applied by Chroma while searching; with a condition on 'document', only the collections
+        holding those documents are searched.
+        """
+        if hybrid and self.lexical_index is None:
+            print('WARNING: no lexical index available (use lexical_index=True), falling back to vector search')
+            hybrid = False
+        where, where_document = checked_filters(where, where_document)
+
+        cache_key = (' '.join(query.lower().split()), amount, hybrid, mmr_lambda, fetch_k, neighbors,
+                     json.dumps(where, sort_keys=True), json.dumps(where_document, sort_keys=True))
+        cached_results = self.query_results.get(cache_key)
+        if cached_results is not None:
+            return [dict(result) for result in cached_results]
+
+        search_status = {'complete': True}
+        results = self._search(query, amount, hybrid, mmr_lambda, fetch_k, search_status, where, where_document)
+        if neighbors > 0:
+            self._expand_with_neighbors(results, neighbors)
+        results = [result for _, result in results]
+        if search_status['complete']:  # results cut short by the query deadline are not cached
+            self.query_results.put(cache_key, results)
+        return [dict(result) for result in results]
+
+    def query_cache_stats(self) -> dict:
+        """Hit/miss counters of the query result cache and the query embedding cache."""
+        return {'results': self.query_results.stats(), 'embeddings': self.query_embeddings.stats()}
+
+    def _search(self, query: str, amount: int, hybrid: bool, mmr_lambda: float, fetch_k: int, search_status: dict,
+                where: dict = None, where_document: dict = None):
+        use_mmr = mmr_lambda is not None
+        result_count = max(fetch_k, amount) if use_mmr else amount
+        candidate_count = result_count * 3 if hybrid else result_count
+
+        collections, where = self._pushdown_filter(where)
+        query_embedding = self.embed_query(query)
+        collection_results = self._query_collections([query_embedding], candidate_count, search_status,
+                                                     include_embeddings=use_mmr, collections=collections,
+                                                     where=where, where_document=where_document)
+
+        # keep the closest results while they come in, instead of sorting all of them
+        closest = heapq.nsmallest(candidate_count, collection_results, key=lambda r: r[2]['distance'])
+        results = [(collection_name, result) for _, collection_name, result in closest]
+        if hybrid:
+            lexical_results = self.lexical_index.search(query, candidate_count)
+            lexical_results = self._filter_lexical_results(lexical_results, collections, where, where_document)
+            results = self._fuse_rankings(results, lexical_results, result_count, include_embeddings=use_mmr)
+
+        if use_mmr:
+            selected = mmr_select(query_embedding, [result['embedding'] for _, result in results], amount, mmr_lambda)
+            results = [results[r] for r in selected]
+            for _, result in results:
+                del result['embedding']
+        return results
+
+    def _expand_with_neighbors(self, results: list, neighbors: int):
+        """
+        Extend the text of every (collection name, result) hit with up to `neighbors` chunks before and after it,
+        following the previous_id/next_id links recorded at ingestion.
+        Each step fetches the next neighbours of all hits at once, with one get per collection.
+        """
+        texts = [[result['document']] for _, result in results]
+        chunk_ids = [[result['metadata'].get('id')] for _, result in results]
+        previous_ids = [result['metadata'].get('previous_id') for _, result in results]
+        next_ids = [result['metadata'].get('next_id') for _, result in results]
+
+        for _ in range(neighbors):
+            wanted = {}
+            for (collection_name, result), previous_id, next_id in zip(results, previous_ids, next_ids):
+                for neighbor_id in [previous_id, next_id]:
+                    if neighbor_id is not None:
+                        wanted.setdefault(collection_name, set()).add(self._chroma_id(result['metadata'], neighbor_id))
+            if len(wanted) == 0:
+                break
+
+            fetched = {}
+            for collection_name, ids in wanted.items():
+                collection = self.cdb_client.get_collection(collection_name, embedding_function=self.embedding_function)
+                contents = collection.get(ids=list(ids), include=['documents', 'metadatas'])
+                for chunk_id, document, meta_info in zip(contents['ids'], contents['documents'], contents['metadatas']):
+                    fetched[(collection_name, chunk_id)] = (document, meta_info)
+
+            for r, (collection_name, result) in enumerate(results):
+                previous_chunk = fetched.get((collection_name, self._chroma_id(result['metadata'], previous_ids[r])))
+                previous_ids[r] = None
+                if previous_chunk is not None:
+                    texts[r].insert(0, previous_chunk[0])
+                    chunk_ids[r].insert(0, previous_chunk[1].get('id'))
+                    previous_ids[r] = previous_chunk[1].get('previous_id')
+                next_chunk = fetched.get((collection_name, self._chroma_id(result['metadata'], next_ids[r])))
+                next_ids[r] = None
+                if next_chunk is not None:
+                    texts[r].append(next_chunk[0])
+                    chunk_ids[r].append(next_chunk[1].get('id'))
+                    next_ids[r] = next_chunk[1].get('next_id')
+
+        for (_, result), text, ids in zip(results, texts, chunk_ids):
+            result['document'] = '\n\n'.join(text)
+            result['chunk_ids'] = ids
+
+    def _filter_lexical_results(self, lexical_results: list, collections: list, where: dict, where_document: dict):
+        """Drop (collection, id, score) lexical hits outside the searched collections or not matching the filters."""
+        collections_by_name = {collection.name: collection for collection in collections}
+        lexical_results = [r for r in lexical_results if r[0] in collections_by_name]
+        if where is None and where_document is None:
+            return lexical_results
+
+        ids_by_collection = {}
+        for collection_name, chunk_id, _ in lexical_results:
+            ids_by_collection.setdefault(collection_name, []).append(chunk_id)
+        matching = set()
+        for collection_name, chunk_ids in ids_by_collection.items():
+            fetched = collections_by_name[collection_name].get(ids=chunk_ids, where=where,
+                                                               where_document=where_document, include=[])
+            matching.update((collection_name, chunk_id) for chunk_id in fetched['ids'])
+        return [r for r in lexical_results if (r[0], r[1]) in matching]
+
+    def _chroma_id(self, meta_info: dict, chunk_id: str):
+        """Id of a chunk in its collection, given the id in its metadata and the metadata of a chunk next to it."""
+        if chunk_id is None or not self.shared_collection:
+            return chunk_id
+        return f'{meta_info["document"]}/{chunk_id}'
+
+    def _fuse_rankings(self, vector_results: list, lexical_results: list, amount: int, include_embeddings=False):
+        """
+        Reciprocal rank fusion of (collection name, result) vector hits and (collection, id, score) lexical hits,
+        returns (collection name, result) pairs.
+        """
+        results_by_key = {(collection_name, result['id']): result for collection_name, result in vector_results}
+        fused_scores = reciprocal_rank_fusion([
+            [(collection_name, result['id']) for collection_name, result in vector_results],
+            [(collection_name, chunk_id) for collection_name, chunk_id, _ in lexical_results]
+        ])
+
+        best_keys = [key for key, _ in fused_scores.most_common(amount)]
+
+        # fetch the chunks that were only found by the lexical search, one get per collection
+        missing_by_collection = {}
+        for collection_name, chunk_id in best_keys:
+            if (collection_name, chunk_id) not in results_by_key:
+                missing_by_collection.setdefault(collection_name, []).append(chunk_id)
+        for collection_name, chunk_ids in missing_by_collection.items():
+            collection = self.cdb_client.get_collection(collection_name, embedding_function=self.embedding_function)
+            include = ['documents', 'metadatas', 'embeddings'] if include_embeddings else ['documents', 'metadatas']
+            fetched = collection.get(ids=chunk_ids, include=include)
+            for c, chunk_id in enumerate(fetched['ids']):
+                result = {'id': chunk_id, 'metadata': fetched['metadatas'][c], 'document': fetched['documents'][c]}
+                if include_embeddings:
+                    result['embedding'] = fetched['embeddings'][c]
+                results_by_key[(collection_name, chunk_id)] = result
+
+        fused = []
+        for key in best_keys:
+            if key in results_by_key:
+                fused.append((key[0], {**results_by_key[key], 'score': fused_scores[key]}))
+        return fused
+
+    def query_store_many(self, queries: list[str], amount: int = 5, fuse: bool = False,
+                         where: dict = None, where_document: dict = None):
+        """
+        Run several queries at once: all queries are embedded in one batch,
+        and every collection is queried once for all of them.
+        Returns a list of results per query, or with fuse=True, one list fused over all queries
+        (reciprocal rank fusion, so chunks found by several queries rank higher).
+        where and where_document filter the chunks, as in query_store.
+        """
+        collections, where = self._pushdown_filter(where)
+        query_embeddings = self.embed_queries(queries)
+        results_per_query = [[] for _ in queries]
+        for q, collection_name, result in self._query_collections(query_embeddings, amount, collections=collections,
+                                                                  where=where, where_document=where_document):
+            results_per_query[q].append((collection_name, result))
+        results_per_query = [heapq.nsmallest(amount, results, key=lambda r: r[1]['distance'])
+                             for results in results_per_query]
+        if not fuse:
+            return [[result for _, result in results] for results in results_per_query]
+
+        results_by_key = {}
+        for results in results_per_query:
+            for collection_name, result in results:
+                results_by_key.setdefault((collection_name, result['id']), result)
+        fused_scores = reciprocal_rank_fusion([[(collection_name, result['id']) for collection_name, result in results]
+                                               for results in results_per_query])
+        return [{**results_by_key[key], 'score': score} for key, score in fused_scores.most_common(amount)]
+
+    def _query_collections(self, query_embeddings: list, amount: int, search_status: dict = None,
+                           include_embeddings: bool = False, collections: list = None,
+                           where: dict = None, where_document: dict = None):
+        """
+        Query every searchable collection, or the given collections (once, for all query embeddings),
+        yielding (query index, collection name, repacked result) as they become available.
+        Stops early when the query deadline has passed (setting search_status['complete'] to False).
+        """
+        if search_status is None:
+            search_status = {}
+        start_time = time.monotonic()
+        if collections is None:
+            collections = self._searchable_collections()
+
+        include = ['metadatas', 'documents', 'distances']
+        if include_embeddings:
+            include.append('embeddings')
+
+        def query_collection(collection):
             results = collection.query(
-                query_texts=[query],
+                query_embeddings=query_embeddings,
                 n_results=amount,
+                where=where,
+                where_document=where_document,
+                include=include,
             )
-            cleaned_results = repack_query_results(results)
-            all_results.extend(cleaned_results)
+            return [(q, collection.name, result)
+                    for q in range(len(query_embeddings))
+                    for result in repack_query_results(results, q)]
+
+        if self.query_pool is None:
+            for collection in collections:
+                if self.query_deadline is not None and time.monotonic() - start_time > self.query_deadline:
+                    print(f'WARNING: query deadline passed, skipped {collection.name} and further collections')
+                    search_status['complete'] = False
+                    return
+                yield from query_collection(collection)
+            return
 
-        # sort results by distance
-        all_results = sorted(all_results, key=lambda r: r['distance'])
-        return all_results[:amount]
+        futures = [self.query_pool.submit(query_collection, collection) for collection in collections]
+        try:
+            for future in as_completed(futures, timeout=self.query_deadline):
+                yield from future.result()
+        except TimeoutError:
+            unfinished = [f for f in futures if not f.done()]
+            print(f'WARNING: query deadline passed, ignoring {len(unfinished)} unfinished collection queries')
+            search_status['complete'] = False
+            for future in unfinished:
+                future.cancel()
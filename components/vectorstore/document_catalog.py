@@ -0,0 +1,167 @@
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+CATALOG_FIELDS = ['name', 'source', 'content_hash', 'chunk_count', 'byte_size', 'ingested_at']
+
+
+def chunk_digest(chunk: str) -> str:
+    return hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+
+
+def document_hash(chunks: list[str]) -> str:
+    """Hash of the content of a document, independent of the order of its chunks."""
+    return digests_hash([chunk_digest(chunk) for chunk in chunks])
+
+
+def digests_hash(chunk_digests: list[str]) -> str:
+    return hashlib.sha256('\n'.join(sorted(chunk_digests)).encode('utf-8')).hexdigest()
+
+
+def catalog_entry(name: str, chunks: list[str], meta_infos: list, ingested_at: float = None) -> dict:
+    entry_builder = CatalogEntryBuilder(name)
+    for chunk, meta_info in zip(chunks, meta_infos):
+        entry_builder.add(chunk, meta_info)
+    return entry_builder.entry(ingested_at)
+
+
+class CatalogEntryBuilder:
+    """Collects the catalog entry of a document chunk by chunk, for documents that are streamed into a store."""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.source = None
+        self.chunk_digests = []
+        self.byte_size = 0
+
+    def add(self, chunk: str, meta_info: dict):
+        if len(self.chunk_digests) == 0:
+            self.source = meta_info.get('source')
+        self.chunk_digests.append(chunk_digest(chunk))
+        self.byte_size += len(chunk.encode('utf-8'))
+
+    def entry(self, ingested_at: float = None) -> dict:
+        return {'name': self.name,
+                'source': self.source,
+                'content_hash': digests_hash(self.chunk_digests),
+                'chunk_count': len(self.chunk_digests),
+                'byte_size': self.byte_size,
+                'ingested_at': time.time() if ingested_at is None else ingested_at}
+
+
+class DocumentCatalog:
+    """
+    Catalog of the stored documents: name, source path, content hash, number of chunks, size in bytes, ingest time.
+    Lookups are served from memory, every change is written to an SQLite file in a single transaction.
+    When another process has changed the file, it is read again on the next lookup.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.documents = {}  # name -> catalog entry
+        self.names_by_hash = {}  # content hash -> names
+
+        self.connection = sqlite3.connect(path or ':memory:', check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS documents '
+                                '(name TEXT PRIMARY KEY, source TEXT, content_hash TEXT, chunk_count INTEGER, '
+                                'byte_size INTEGER, ingested_at REAL)')
+        self.connection.commit()
+        self._loaded_mtime = None
+        self._refresh()
+
+    def _file_mtime(self):
+        return None if self.path is None else os.path.getmtime(self.path)
+
+    def _refresh(self):
+        """Read the catalog again when the file changed since it was last read (call while holding the lock)."""
+        mtime = self._file_mtime()
+        if self._loaded_mtime is not None and mtime == self._loaded_mtime:
+            return
+        self.documents = {}
+        self.names_by_hash = {}
+        for row in self.connection.execute(f'SELECT {", ".join(CATALOG_FIELDS)} FROM documents'):
+            self._remember(dict(zip(CATALOG_FIELDS, row)))
+        self._loaded_mtime = mtime if mtime is not None else 0
+
+    def _remember(self, entry: dict):
+        self.documents[entry['name']] = entry
+        self.names_by_hash.setdefault(entry['content_hash'], set()).add(entry['name'])
+
+    def _forget(self, name: str):
+        entry = self.documents.pop(name, None)
+        if entry is not None:
+            self.names_by_hash.get(entry['content_hash'], set()).discard(name)
+
+    def _written(self):
+        if self.path is not None:
+            self._loaded_mtime = self._file_mtime()  # our own change is already in memory
+
+    def put(self, entry: dict):
+        with self._lock:
+            self._refresh()
+            with self.connection:  # one transaction
+                self.connection.execute(f'INSERT OR REPLACE INTO documents ({", ".join(CATALOG_FIELDS)}) '
+                                        f'VALUES ({", ".join("?" for _ in CATALOG_FIELDS)})',
+                                        [entry[field] for field in CATALOG_FIELDS])
+            self._written()
+            self._forget(entry['name'])
+            self._remember(entry)
+
+    def remove(self, name: str):
+        with self._lock:
+            self._refresh()
+            with self.connection:
+                self.connection.execute('DELETE FROM documents WHERE name = ?', (name,))
+            self._written()
+            self._forget(name)
+
+    def replace_all(self, entries: list):
+        with self._lock:
+            with self.connection:
+                self.connection.execute('DELETE FROM documents')
+                self.connection.executemany(f'INSERT INTO documents ({", ".join(CATALOG_FIELDS)}) '
+                                            f'VALUES ({", ".join("?" for _ in CATALOG_FIELDS)})',
+                                            [[entry[field] for field in CATALOG_FIELDS] for entry in entries])
+            self._written()
+            self.documents = {}
+            self.names_by_hash = {}
+            for entry in entries:
+                self._remember(entry)
+
+    def get(self, name: str):
+        with self._lock:
+            self._refresh()
+            entry = self.documents.get(name)
+            return None if entry is None else dict(entry)
+
+    def names_with_hash(self, content_hash: str) -> list:
+        with self._lock:
+            self._refresh()
+            return sorted(self.names_by_hash.get(content_hash, []))
+
+    def names(self) -> list:
+        with self._lock:
+            self._refresh()
+            return sorted(self.documents.keys())
+
+    def entries(self) -> list:
+        with self._lock:
+            self._refresh()
+            return [dict(self.documents[name]) for name in sorted(self.documents.keys())]
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def __contains__(self, name: str):
+        with self._lock:
+            self._refresh()
+            return name in self.documents
+
+    def __len__(self):
+        with self._lock:
+            self._refresh()
+            return len(self.documents)
@@ -0,0 +1,83 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+
+def embedding_model_id(embedding_function) -> str:
+    """Identify an embedding function (name and configuration), so cached vectors of other models are never reused."""
+    try:
+        return f'{embedding_function.name()}:{json.dumps(embedding_function.get_config(), sort_keys=True)}'
+    except Exception:
+        return type(embedding_function).__name__
+
+
+class EmbeddingCache:
+    """
+    Persistent cache of chunk embeddings, stored in an SQLite file.
+    Entries are keyed by the hash of the embedding model id and the chunk text.
+    When the stored vectors exceed max_size_mb, the least recently used entries are evicted.
+    """
+
+    def __init__(self, path: str, model_id: str, max_size_mb: float = 256):
+        self.model_id = model_id
+        self.max_bytes = int(max_size_mb * 1024 * 1024)
+        self._lock = threading.Lock()
+
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS embeddings '
+                                '(key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)')
+        self.connection.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+        self.connection.commit()
+        self.total_bytes = self.connection.execute('SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings').fetchone()[0]
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f'{self.model_id}\n{text}'.encode('utf-8')).hexdigest()
+
+    def get_many(self, texts: list[str]) -> list:
+        """Return the cached embedding for each text, or None when it is not in the cache."""
+        keys = [self._key(text) for text in texts]
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), 500):  # stay below the SQLite variable limit
+                batch = keys[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = self.connection.execute(f'SELECT key, vector FROM embeddings WHERE key IN ({placeholders})',
+                                               batch).fetchall()
+                found.update((key, np.frombuffer(vector, dtype=np.float32)) for key, vector in rows)
+            if found:
+                self.connection.executemany('UPDATE embeddings SET last_used = ? WHERE key = ?',
+                                            [(time.time(), key) for key in found])
+                self.connection.commit()
+        return [found.get(key) for key in keys]
+
+    def put_many(self, texts: list[str], embeddings: list):
+        rows = [(self._key(text), np.asarray(embedding, dtype=np.float32).tobytes(), time.time())
+                for text, embedding in zip(texts, embeddings)]
+        with self._lock:
+            self.connection.executemany('INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)',
+                                        rows)
+            self.total_bytes += sum(len(row[1]) for row in rows)
+            if self.total_bytes > self.max_bytes:
+                self._evict()
+            self.connection.commit()
+
+    def _evict(self):
+        # drop the least recently used entries until the cache is back at 90% of its maximum size
+        entry_size = self.connection.execute('SELECT AVG(LENGTH(vector)) FROM embeddings').fetchone()[0] or 1
+        excess = self.total_bytes - int(self.max_bytes * 0.9)
+        evict_count = int(excess // entry_size) + 1
+        self.connection.execute('DELETE FROM embeddings WHERE key IN '
+                                '(SELECT key FROM embeddings ORDER BY last_used LIMIT ?)', (evict_count,))
+        self.total_bytes = self.connection.execute('SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings').fetchone()[0]
+
+    def close(self):
+        with self._lock:
+            self.connection.close()
+
+    def __len__(self):
+        with self._lock:
+            return self.connection.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
@@ -0,0 +1,109 @@
+import argparse
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import numpy as np
+from chromadb import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+
+class RemoteEmbeddingFunction(EmbeddingFunction):
+    """
+    Embedding function that sends texts to a shared embedding worker (see run_embedding_server below),
+    so processes on the same machine do not each load their own copy of the model.
+    Requests go over a pooled keep-alive HTTP connection.
+    It reports the name and configuration of the worker's model, so collections and cached embeddings
+    made with that model locally remain valid.
+    """
+
+    def __init__(self, url: str, max_connections: int = 16, timeout: float = 60):
+        self.url = url.rstrip('/')
+        self.http_client = httpx.Client(timeout=timeout,
+                                        limits=httpx.Limits(max_connections=max_connections,
+                                                            max_keepalive_connections=max_connections))
+        self._model_info = None
+
+    def model_info(self) -> dict:
+        if self._model_info is None:
+            response = self.http_client.get(f'{self.url}/info')
+            response.raise_for_status()
+            self._model_info = response.json()
+        return self._model_info
+
+    def __call__(self, input: Documents) -> Embeddings:
+        response = self.http_client.post(f'{self.url}/embed', json={'texts': list(input)})
+        response.raise_for_status()
+        return [np.array(embedding, dtype=np.float32) for embedding in response.json()['embeddings']]
+
+    def name(self) -> str:
+        return self.model_info()['name']
+
+    def get_config(self) -> dict:
+        return self.model_info()['config']
+
+    @staticmethod
+    def build_from_config(config: dict):
+        raise ValueError('RemoteEmbeddingFunction needs the url of an embedding worker')
+
+
+def run_embedding_server(host: str = 'localhost', port: int = 8100, embedding_function=None):
+    """
+    Serve an embedding model over HTTP to the document stores of all local processes:
+    POST /embed {"texts": [...]} returns {"embeddings": [[...], ...]}, GET /info describes the model.
+    The model is loaded once; requests are handled on threads, and only one batch is embedded at a time.
+    """
+    if embedding_function is None:
+        embedding_function = DefaultEmbeddingFunction()
+    model_lock = threading.Lock()
+    try:
+        model_info = {'name': embedding_function.name(), 'config': embedding_function.get_config()}
+    except Exception:
+        model_info = {'name': type(embedding_function).__name__, 'config': {}}
+
+    class EmbeddingRequestHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'  # keep connections open between requests
+
+        def _send_json(self, status: int, body: dict):
+            data = json.dumps(body).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if self.path == '/info':
+                self._send_json(200, model_info)
+            else:
+                self._send_json(404, {'error': f'unknown path {self.path}'})
+
+        def do_POST(self):
+            if self.path != '/embed':
+                self._send_json(404, {'error': f'unknown path {self.path}'})
+                return
+            try:
+                texts = json.loads(self.rfile.read(int(self.headers['Content-Length'])))['texts']
+                with model_lock:
+                    embeddings = embedding_function(texts)
+                self._send_json(200, {'embeddings': [np.asarray(e, dtype=np.float32).tolist() for e in embeddings]})
+            except Exception as e:
+                self._send_json(500, {'error': str(e)})
+
+        def log_message(self, format, *args):
+            pass  # one line per request is too noisy
+
+    server = ThreadingHTTPServer((host, port), EmbeddingRequestHandler)
+    print(f'Embedding worker for {model_info["name"]} listening on http://{host}:{port}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs one embedding worker process, shared by every document store '
+                                                 'on this machine (set EMBEDDING_SERVER_URL in their .env files).')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=8100)
+    args = parser.parse_args()
+
+    run_embedding_server(args.host, args.port)
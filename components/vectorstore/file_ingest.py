@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from tqdm import tqdm
+
+sys.path.append('../')
+sys.path.append('../../')
+
+from components.text_utils.md_chunking import chunk_records
+from components.text_utils.md_conversion import document_to_markdown
+from components.text_utils.string_utils import sanitize_filename
+
+
+def prepare_file(file_path: str, uploaded_at: int, max_tokens: int = None) -> tuple[str, list[str], list[dict]]:
+    """Convert a file to Markdown and chunk it: returns the document name, the chunks and their metadata."""
+    md_text = document_to_markdown(file_path)
+    # offsets, header path and pages of every chunk, for filters and citations
+    records = chunk_records(md_text, max_tokens=max_tokens)
+    chunks = [record['text'] for record in records]
+    meta_infos = [{'source': file_path, 'id': f'chunk_{i}', 'uploaded_at': uploaded_at, **record['metadata']}
+                  for i, record in enumerate(records)]
+    return sanitize_filename(file_path), chunks, meta_infos
+
+
+def ingest_files(cdb_store, file_paths: list[str], progress=None, max_workers: int = None, max_tokens: int = None,
+                 tqdm_func=tqdm) -> list[str]:
+    """
+    Add (or update) files in a document store. Files are converted and chunked in parallel in worker processes;
+    the chunks of each converted file are embedded in batches and written by the calling thread (a single writer),
+    in the order the files are ready.
+    progress (e.g. a gr.Progress) is called with (files done, number of files) after each file.
+    Returns the names of the stored documents; files that fail are reported and skipped.
+    """
+    if len(file_paths) == 0:
+        return []
+    if max_workers is None:
+        max_workers = min(len(file_paths), os.cpu_count() or 1)
+    uploaded_at = int(time.time())
+    if progress is not None:
+        progress((0, len(file_paths)), desc=f'Converting {len(file_paths)} files', unit='files')
+
+    stored = []
+    # spawn, not fork: forking a running app copies its ONNX runtime threads, thread pools and SQLite connections,
+    # which can deadlock the workers (callers need an `if __name__ == '__main__'` guard)
+    with ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+        futures = {pool.submit(prepare_file, file_path, uploaded_at, max_tokens): file_path
+                   for file_path in file_paths}
+        for done, future in enumerate(as_completed(futures), start=1):
+            file_path = futures[future]
+            try:
+                document_name, chunks, meta_infos = future.result()
+                # documents that are already stored are updated: only changed chunks get embedded again
+                cdb_store.update_document(document_name=document_name,
+                                          chunks=chunks,
+                                          meta_infos=meta_infos,
+                                          tqdm_func=tqdm_func)
+                stored.append(document_name)
+            except Exception as e:
+                print(f'WARNING: could not add {file_path}: {e}')
+            if progress is not None:
+                progress((done, len(file_paths)), desc=f'Stored {os.path.basename(file_path)}', unit='files')
+    return stored
@@ -0,0 +1,97 @@
+import argparse
+import sys
+import time
+
+import numpy as np
+
+sys.path.append('../../')
+
+from components.vectorstore.chroma_document_store import ChromaDocumentStore
+
+
+def synthetic_corpus(chunk_count: int, dimension: int, cluster_count: int = 50, seed: int = 0) -> np.ndarray:
+    """Normalized random embeddings grouped around topic centers, like the chunks of a set of documents."""
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(cluster_count, dimension))
+    embeddings = centers[rng.integers(cluster_count, size=chunk_count)] + rng.normal(scale=0.6,
+                                                                                     size=(chunk_count, dimension))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings.astype(np.float32)
+
+
+def exact_neighbors(corpus: np.ndarray, queries: np.ndarray, k: int) -> list[set]:
+    """Ground truth by brute force (on normalized vectors cosine, l2 and ip rank the same)."""
+    similarities = queries @ corpus.T
+    best = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    return [set(row.tolist()) for row in best]
+
+
+def benchmark_hnsw(corpus: np.ndarray, queries: np.ndarray, k: int,
+                   max_neighbors_values: list[int], ef_search_values: list[int],
+                   ef_construction: int = 100, space: str = 'cosine') -> list[dict]:
+    """
+    Build a collection for every combination of max_neighbors (M) and ef_search, and query it.
+    (ef_search is fixed once the index is loaded, so changing it on an existing collection would measure nothing.)
+    Returns recall@k against exact search and the p50/p95 latency of single queries (in ms) per setting.
+    """
+    truth = exact_neighbors(corpus, queries, k)
+    ids = [str(i) for i in range(len(corpus))]
+    report = []
+    for max_neighbors in max_neighbors_values:
+        for ef_search in ef_search_values:
+            cdb_store = ChromaDocumentStore(path=None, embedding_function=None,
+                                            embedding_cache_size_mb=0,
+                                            hnsw_config={'space': space,
+                                                         'ef_construction': ef_construction,
+                                                         'ef_search': ef_search,
+                                                         'max_neighbors': max_neighbors})
+            collection_name = f'hnsw-benchmark-m{max_neighbors}-ef{ef_search}'
+            collection = cdb_store._create_collection(collection_name)
+
+            build_start = time.perf_counter()
+            batch_size = cdb_store.cdb_client.get_max_batch_size()
+            for start in range(0, len(corpus), batch_size):
+                collection.add(ids=ids[start:start + batch_size], embeddings=corpus[start:start + batch_size])
+            build_time = time.perf_counter() - build_start
+
+            latencies = []
+            recalls = []
+            for query, expected in zip(queries, truth):
+                query_start = time.perf_counter()
+                result = collection.query(query_embeddings=[query], n_results=k, include=[])
+                latencies.append((time.perf_counter() - query_start) * 1000)
+                recalls.append(len(expected & {int(i) for i in result['ids'][0]}) / k)
+            report.append({'max_neighbors': max_neighbors,
+                           'ef_search': ef_search,
+                           'build_seconds': build_time,
+                           f'recall@{k}': float(np.mean(recalls)),
+                           'p50_ms': float(np.percentile(latencies, 50)),
+                           'p95_ms': float(np.percentile(latencies, 95))})
+            cdb_store.cdb_client.delete_collection(collection_name)
+    return report
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Sweeps HNSW index parameters (M and search_ef) on a synthetic corpus '
+                                                 'and reports recall@k against exact search and query latency, '
+                                                 'to choose the hnsw_config of a ChromaDocumentStore.')
+    parser.add_argument('--chunks', type=int, default=20000, help='Number of chunks in the synthetic corpus.')
+    parser.add_argument('--dimension', type=int, default=384, help='Embedding dimension (384 for the default model).')
+    parser.add_argument('--queries', type=int, default=200, help='Number of queries per setting.')
+    parser.add_argument('-k', type=int, default=5, help='Number of results per query.')
+    parser.add_argument('--m', type=int, nargs='+', default=[8, 16, 32], help='max_neighbors (M) values to try.')
+    parser.add_argument('--ef-search', type=int, nargs='+', default=[10, 50, 100, 200],
+                        help='ef_search values to try.')
+    parser.add_argument('--ef-construction', type=int, default=100)
+    parser.add_argument('--space', choices=['cosine', 'l2', 'ip'], default='cosine')
+    args = parser.parse_args()
+
+    # queries are drawn from the same topics as the corpus, but are not in it
+    embeddings = synthetic_corpus(args.chunks + args.queries, args.dimension)
+    corpus, queries = embeddings[:args.chunks], embeddings[args.chunks:]
+    report = benchmark_hnsw(corpus, queries, args.k, args.m, args.ef_search, args.ef_construction, args.space)
+
+    print(f'{"M":>4} {"ef_search":>10} {"build s":>8} {f"recall@{args.k}":>10} {"p50 ms":>8} {"p95 ms":>8}')
+    for row in report:
+        print(f'{row["max_neighbors"]:>4} {row["ef_search"]:>10} {row["build_seconds"]:>8.1f} '
+              f'{row[f"recall@{args.k}"]:>10.3f} {row["p50_ms"]:>8.2f} {row["p95_ms"]:>8.2f}')
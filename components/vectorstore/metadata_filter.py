@@ -0,0 +1,110 @@
+from chromadb.api.types import validate_where, validate_where_document
+
+COMPARISONS = {
+    '$eq': lambda value, operand: value == operand,
+    '$ne': lambda value, operand: value != operand,
+    '$gt': lambda value, operand: value is not None and value > operand,
+    '$gte': lambda value, operand: value is not None and value >= operand,
+    '$lt': lambda value, operand: value is not None and value < operand,
+    '$lte': lambda value, operand: value is not None and value <= operand,
+    '$in': lambda value, operand: value in operand,
+    '$nin': lambda value, operand: value not in operand,
+}
+
+
+def checked_filters(where: dict, where_document: dict):
+    """
+    Empty filters become None; an invalid filter raises a ValueError (the one Chroma would raise)
+    before anything is searched, so callers such as tools can report it.
+    """
+    where = where or None
+    where_document = where_document or None
+    if where is not None:
+        validate_where(where)
+    if where_document is not None:
+        validate_where_document(where_document)
+    return where, where_document
+
+
+def _condition_values(condition: dict, key: str):
+    """The values a single condition allows for key ({key: value}, {key: {'$eq' or '$in': ...}}), or None."""
+    operand = condition.get(key) if len(condition) == 1 else None
+    if isinstance(operand, dict) and len(operand) == 1 and next(iter(operand)) in ['$eq', '$in']:
+        operand = operand.get('$eq', operand.get('$in'))
+    if isinstance(operand, str):
+        operand = [operand]
+    return set(operand) if isinstance(operand, list) else None
+
+
+def filter_values(where: dict, key: str):
+    """
+    The values a `where` filter allows for key, from a condition on key at the top level or in a top level '$and'.
+    Returns None when the filter does not restrict key to a set of values.
+    """
+    if not where:
+        return None
+    conditions = where['$and'] if '$and' in where else [{k: value} for k, value in where.items()]
+    values = None
+    for condition in conditions:
+        condition_values = _condition_values(condition, key)
+        if condition_values is not None:
+            values = condition_values if values is None else values & condition_values
+    return values
+
+
+def split_document_filter(where: dict):
+    """
+    Take the condition on the document name out of a Chroma `where` filter,
+    so the store can pick the collections (or rows) to search instead of filtering chunk by chunk.
+    Understands {'document': name}, {'document': {'$eq': name}}, {'document': {'$in': [names]}},
+    also as one of the conditions of a top level '$and'.
+    Returns (set of document names or None when not restricted, the rest of the filter or None).
+    """
+    if not where:
+        return None, None
+
+    conditions = where['$and'] if '$and' in where else [{key: value} for key, value in where.items()]
+    document_names = filter_values(where, 'document')
+    rest = [condition for condition in conditions if _condition_values(condition, 'document') is None]
+
+    if len(rest) == 0:
+        return document_names, None
+    if len(rest) == 1:
+        return document_names, rest[0]
+    return document_names, {'$and': rest}
+
+
+def matches_where(meta_info: dict, where: dict) -> bool:
+    """Evaluate a Chroma `where` filter on the metadata of one chunk (for stores without Chroma)."""
+    if not where:
+        return True
+    for key, condition in where.items():
+        if key == '$and':
+            if not all(matches_where(meta_info, c) for c in condition):
+                return False
+        elif key == '$or':
+            if not any(matches_where(meta_info, c) for c in condition):
+                return False
+        else:
+            if not isinstance(condition, dict):
+                condition = {'$eq': condition}
+            value = meta_info.get(key)
+            if not all(COMPARISONS[operator](value, operand) for operator, operand in condition.items()):
+                return False
+    return True
+
+
+def matches_where_document(text: str, where_document: dict) -> bool:
+    """Evaluate a Chroma `where_document` filter ($contains, $not_contains, $and, $or) on the text of one chunk."""
+    if not where_document:
+        return True
+    for key, condition in where_document.items():
+        if key == '$contains' and condition not in text:
+            return False
+        if key == '$not_contains' and condition in text:
+            return False
+        if key == '$and' and not all(matches_where_document(text, c) for c in condition):
+            return False
+        if key == '$or' and not any(matches_where_document(text, c) for c in condition):
+            return False
+    return True
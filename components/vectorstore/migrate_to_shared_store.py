@@ -0,0 +1,62 @@
+import argparse
+import sys
+
+import chromadb
+from tqdm import tqdm
+
+sys.path.append('../../')
+
+from components.vectorstore.chroma_document_store import INGEST_MARKER_COLLECTION, SHARED_COLLECTION_PREFIX, \
+    shard_collection_name
+
+
+def migrate_to_shared_store(source_path: str,
+                            target_path: str = None,
+                            shard_count: int = 1,
+                            remove_source: bool = False):
+    """
+    Copy every per-document collection of a store into the shared (sharded) layout.
+    The stored embeddings are copied as well, so nothing is embedded again.
+    When target_path is None, the shared collections are written next to the old ones.
+    """
+    source_client = chromadb.PersistentClient(path=source_path)
+    if target_path is None or target_path == source_path:
+        target_client = source_client
+    else:
+        target_client = chromadb.PersistentClient(path=target_path)
+    batch_size = target_client.get_max_batch_size()
+
+    collections = [c for c in source_client.list_collections()
+                   if not c.name.startswith(SHARED_COLLECTION_PREFIX) and c.name != INGEST_MARKER_COLLECTION]
+    for collection in tqdm(collections, desc='documents'):
+        document_name = collection.name
+        shard = target_client.get_or_create_collection(shard_collection_name(document_name, shard_count))
+
+        contents = collection.get(include=['documents', 'metadatas', 'embeddings'])
+        ids = [f'{document_name}/{chunk_id}' for chunk_id in contents['ids']]
+        metadatas = [{**meta_info, 'document': document_name} for meta_info in contents['metadatas']]
+        for start in range(0, len(ids), batch_size):
+            end = start + batch_size
+            shard.upsert(ids=ids[start:end],
+                         documents=contents['documents'][start:end],
+                         metadatas=metadatas[start:end],
+                         embeddings=contents['embeddings'][start:end])
+
+        if remove_source:
+            source_client.delete_collection(document_name)
+
+    print(f'Migrated {len(collections)} documents into {shard_count} shared collection(s)')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts a ChromaDocumentStore with one collection per document '
+                                                 'into the shared collection layout (shared_collection=True).')
+    parser.add_argument('source', help='Path of the existing (per-document) store.')
+    parser.add_argument('--target', default=None,
+                        help='Path for the migrated store (default: migrate in place).')
+    parser.add_argument('--shards', type=int, default=1, help='Number of shared collections to spread documents over.')
+    parser.add_argument('--remove-source', action='store_true',
+                        help='Delete each per-document collection once it has been copied.')
+    args = parser.parse_args()
+
+    migrate_to_shared_store(args.source, args.target, max(1, args.shards), args.remove_source)
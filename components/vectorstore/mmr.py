@@ -0,0 +1,36 @@
+import numpy as np
+
+
+def mmr_select(query_embedding, candidate_embeddings, amount: int,
+               mmr_lambda: float = 0.5,
+               duplicate_threshold: float = 0.95) -> list[int]:
+    """
+    Maximal marginal relevance: pick `amount` candidates that are relevant to the query but differ from each other.
+    mmr_lambda=1 ranks on relevance only, lower values favour diversity.
+    Candidates with a cosine similarity above duplicate_threshold to an already picked one are dropped entirely.
+    All similarities are computed at once (one matrix product), returns the indices of the picked candidates.
+    """
+    candidates = np.asarray(candidate_embeddings, dtype=np.float32)
+    if len(candidates) == 0:
+        return []
+    candidates = candidates / np.maximum(np.linalg.norm(candidates, axis=1, keepdims=True), 1e-12)
+    query = np.asarray(query_embedding, dtype=np.float32)
+    query = query / max(float(np.linalg.norm(query)), 1e-12)
+
+    relevance = candidates @ query
+    similarity = candidates @ candidates.T
+
+    available = np.ones(len(candidates), dtype=bool)
+    max_similarity = np.full(len(candidates), -np.inf, dtype=np.float32)  # to the candidates picked so far
+    selected = []
+    while len(selected) < amount and available.any():
+        redundancy = np.where(np.isinf(max_similarity), 0, max_similarity)
+        scores = mmr_lambda * relevance - (1 - mmr_lambda) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+
+        available[best] = False
+        max_similarity = np.maximum(max_similarity, similarity[:, best])
+        available &= max_similarity < duplicate_threshold  # near-copies of a picked chunk
+    return selected
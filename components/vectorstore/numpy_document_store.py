@@ -0,0 +1,361 @@
+import json
+import os
+import sys
+from itertools import islice
+
+import numpy as np
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+from tqdm import tqdm
+
+sys.path.append('../')
+sys.path.append('../../demos/')
+
+from components.text_utils.string_utils import clean_up_string
+from components.vectorstore.document_catalog import CatalogEntryBuilder
+from components.vectorstore.lru_cache import LRUCache
+from components.vectorstore.metadata_filter import checked_filters, matches_where, matches_where_document, \
+    split_document_filter
+from components.vectorstore.mmr import mmr_select
+
+STORE_FILE = 'store.json'  # dimension, number of rows and the row range of every document
+VECTORS_FILE = 'vectors.bin'  # normalized embeddings, one row per chunk (float32, or int8 when quantized)
+SCALES_FILE = 'scales.bin'  # float32 scale factor per row (int8 only)
+SCORE_BLOCK_ROWS = 8192  # int8 rows are cast to float32 one block at a time when scoring a query
+CHUNKS_FILE = 'chunks.jsonl'  # id, document name, metadata and text of every chunk, one JSON object per line
+OFFSETS_FILE = 'offsets.bin'  # int64 byte offset of every row in CHUNKS_FILE
+
+
+class NumpyDocumentStore:
+    """
+    Read-mostly document store on a flat array of embeddings, with the same methods as ChromaDocumentStore.
+    All files are append-only and memory-mapped, so the store opens instantly
+    and several worker processes share the same pages.
+    A query is one matrix-vector product over all chunks (cosine similarity) followed by argpartition.
+    Removed documents leave unused rows behind, until compact() is called.
+    """
+
+    def __init__(self, path: str, embedding_function=None, quantize: bool = False, query_cache_size: int = 128):
+        if path is None:
+            raise ValueError('NumpyDocumentStore needs a folder to store its files in')
+        os.makedirs(path, exist_ok=True)
+        self.path = path
+
+        if embedding_function is None:
+            embedding_function = DefaultEmbeddingFunction()
+        self.embedding_function = embedding_function
+        self.query_embeddings = LRUCache(max_size=query_cache_size)
+        self.hybrid_warning_shown = False
+
+        self.store_info = {'dtype': 'int8' if quantize else 'float32', 'dimension': None, 'rows': 0, 'documents': {}}
+        self._loaded_mtime = None
+        self._load()
+
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        """(Re)open the store files, when another process has changed them since they were last opened."""
+        store_file = self._file(STORE_FILE)
+        if not os.path.exists(store_file):
+            self.vectors, self.scales, self.offsets, self.live_rows = None, None, None, None
+            return
+        mtime = os.path.getmtime(store_file)
+        if mtime == self._loaded_mtime:
+            return
+
+        with open(store_file, 'r', encoding='utf-8') as f:
+            self.store_info = json.load(f)
+        self._loaded_mtime = mtime
+
+        rows, dimension = self.store_info['rows'], self.store_info['dimension']
+        if rows == 0:
+            self.vectors, self.scales, self.offsets, self.live_rows = None, None, None, None
+            return
+        self.vectors = np.memmap(self._file(VECTORS_FILE), dtype=self.store_info['dtype'], mode='r',
+                                 shape=(rows, dimension))
+        self.offsets = np.memmap(self._file(OFFSETS_FILE), dtype=np.int64, mode='r', shape=(rows,))
+        self.scales = None
+        if self.store_info['dtype'] == 'int8':
+            self.scales = np.memmap(self._file(SCALES_FILE), dtype=np.float32, mode='r', shape=(rows,))
+
+        # rows of removed documents are skipped when querying
+        self.live_rows = np.zeros(rows, dtype=bool)
+        for document in self.store_info['documents'].values():
+            self.live_rows[document['start']:document['start'] + document['count']] = True
+
+    def _save_store_info(self):
+        # write to a temporary file first, so readers never see a half written file
+        temp_file = self._file(STORE_FILE + '.tmp')
+        with open(temp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.store_info, f)
+        os.replace(temp_file, self._file(STORE_FILE))
+        self._loaded_mtime = None
+        self._load()
+
+    def embed_query(self, query: str):
+        embedding = self.query_embeddings.get(query)
+        if embedding is None:
+            embedding = normalize(self.embedding_function([query]))[0]
+            self.query_embeddings.put(query, embedding)
+        return embedding
+
+    def add_document(self, document_name: str,
+                     chunks: list[str],
+                     meta_infos: list,
+                     tqdm_func=tqdm,
+                     batch_size: int = 64):
+        self._load()
+        collection_name = clean_up_string(document_name)
+        if collection_name in self.store_info['documents']:
+            print(f'A document with this name is already in the collection: {collection_name}')
+            return
+
+        self._truncate_uncommitted_rows()
+        start_row = self.store_info['rows']
+        # chunks and meta_infos can also be iterators (e.g. from stream_chunking), they are read batch by batch
+        taqaddum = tqdm_func(total=len(chunks) if isinstance(chunks, list) else None)
+        taqaddum.set_description(desc=collection_name)
+        entry_builder = CatalogEntryBuilder(collection_name)
+        with (open(self._file(VECTORS_FILE), 'ab') as vectors_file,
+              open(self._file(OFFSETS_FILE), 'ab') as offsets_file,
+              open(self._file(CHUNKS_FILE), 'ab') as chunks_file):
+            chunks_with_meta_infos = zip(chunks, meta_infos)
+            while batch := list(islice(chunks_with_meta_infos, batch_size)):
+                batch_chunks = [chunk for chunk, _ in batch]
+                embeddings = normalize(self.embedding_function(batch_chunks))
+                if self.store_info['dimension'] is None:
+                    self.store_info['dimension'] = embeddings.shape[1]
+
+                if self.store_info['dtype'] == 'int8':
+                    embeddings, scales = quantize_int8(embeddings)
+                    with open(self._file(SCALES_FILE), 'ab') as scales_file:
+                        scales_file.write(scales.tobytes())
+                vectors_file.write(embeddings.tobytes())
+
+                offsets = []
+                for chunk, meta_info in batch:
+                    offsets.append(chunks_file.tell())
+                    line = json.dumps({'id': meta_info['id'], 'metadata': meta_info, 'document': chunk})
+                    chunks_file.write(line.encode('utf-8') + b'\n')
+                    entry_builder.add(chunk, meta_info)
+                offsets_file.write(np.array(offsets, dtype=np.int64).tobytes())
+                taqaddum.update(len(offsets))
+        taqaddum.close()
+
+        entry = entry_builder.entry()
+        self.store_info['rows'] = start_row + entry['chunk_count']
+        self.store_info['documents'][collection_name] = {'start': start_row, 'count': entry['chunk_count'],
+                                                         **{key: entry[key] for key in
+                                                            ['source', 'content_hash', 'byte_size', 'ingested_at']}}
+        self._save_store_info()
+
+    def _truncate_uncommitted_rows(self):
+        """Cut off the rows an interrupted add_document appended without recording them in the store file."""
+        rows, dimension = self.store_info['rows'], self.store_info['dimension']
+        if rows == 0:
+            chunks_size = 0
+        else:
+            with open(self._file(CHUNKS_FILE), 'rb') as chunks_file:
+                chunks_file.seek(int(self.offsets[rows - 1]))
+                chunks_size = chunks_file.tell() + len(chunks_file.readline())
+        sizes = {CHUNKS_FILE: chunks_size, OFFSETS_FILE: rows * 8}
+        if dimension is not None:
+            sizes[VECTORS_FILE] = rows * dimension * np.dtype(self.store_info['dtype']).itemsize
+            sizes[SCALES_FILE] = rows * 4
+        for name, size in sizes.items():
+            if os.path.exists(self._file(name)) and os.path.getsize(self._file(name)) > size:
+                print(f'WARNING: dropping the rows of an interrupted ingest from {name}')
+                os.truncate(self._file(name), size)
+
+    def update_document(self, document_name: str,
+                        chunks: list[str],
+                        meta_infos: list,
+                        tqdm_func=tqdm):
+        """Replace a stored document (the flat store has no partial updates, all chunks are embedded again)."""
+        collection_name = clean_up_string(document_name)
+        self._load()
+        if collection_name in self.store_info['documents']:
+            self.remove_document(collection_name)
+        self.add_document(collection_name, chunks, meta_infos, tqdm_func)
+
+    def remove_document(self, document_name):
+        self._load()
+        if self.store_info['documents'].pop(document_name, None) is not None:
+            self._save_store_info()
+
+    def list_documents(self):
+        self._load()
+        return sorted(self.store_info['documents'].keys())
+
+    def document_catalog(self) -> list:
+        """Name, source, content hash, chunk count, size in bytes and ingest time of every stored document."""
+        self._load()
+        return [{'name': name,
+                 'source': document.get('source'),
+                 'content_hash': document.get('content_hash'),
+                 'chunk_count': document['count'],
+                 'byte_size': document.get('byte_size'),
+                 'ingested_at': document.get('ingested_at')}
+                for name, document in sorted(self.store_info['documents'].items())]
+
+    def query_store(self, query: str, amount: int = 5, hybrid: bool = False,
+                    mmr_lambda: float = None, fetch_k: int = 20, neighbors: int = 0,
+                    where: dict = None, where_document: dict = None):
+        """
+        Same arguments as ChromaDocumentStore.query_store.
+        A 'document' condition in where limits the search to the rows of those documents,
+        other conditions are checked on the closest chunks until enough of them match.
+        """
+        if hybrid and not self.hybrid_warning_shown:
+            print('WARNING: NumpyDocumentStore has no lexical index, falling back to vector search')
+            self.hybrid_warning_shown = True  # the RAG tools ask for hybrid search on every query
+        where, where_document = checked_filters(where, where_document)
+        self._load()
+        if self.vectors is None:
+            return []
+        document_names, where = split_document_filter(where)
+        searchable_rows = self._searchable_rows(document_names)
+        if not searchable_rows.any():
+            return []
+
+        query_embedding = self.embed_query(query)
+        similarities = self._similarities(np.asarray(query_embedding, dtype=np.float32))
+        similarities[~searchable_rows] = -np.inf
+
+        result_count = max(fetch_k, amount) if mmr_lambda is not None else amount
+        result_count = min(result_count, int(searchable_rows.sum()))
+        if where is None and where_document is None:
+            best_rows = np.argpartition(-similarities, result_count - 1)[:result_count]
+            best_rows = best_rows[np.argsort(-similarities[best_rows])]
+        else:
+            ranked_rows = np.argsort(-similarities)[:int(searchable_rows.sum())]
+            best_rows = self._matching_rows(ranked_rows, result_count, where, where_document)
+
+        if mmr_lambda is not None:
+            candidates = np.asarray(self.vectors[best_rows], dtype=np.float32)  # scale of int8 rows does not matter
+            best_rows = best_rows[mmr_select(query_embedding, candidates, amount, mmr_lambda)]
+
+        results = []
+        with open(self._file(CHUNKS_FILE), 'rb') as chunks_file:
+            for row in best_rows:
+                chunk_info = self._read_chunk(chunks_file, row)
+                result = {'id': chunk_info['id'],
+                          'distance': float(1 - similarities[row]),  # cosine distance
+                          'metadata': chunk_info['metadata'],
+                          'document': chunk_info['document']}
+                if neighbors > 0:
+                    # the chunks of a document are stored in consecutive rows
+                    first_row, last_row = self._document_rows(row)
+                    rows = range(max(first_row, row - neighbors), min(last_row, row + neighbors) + 1)
+                    context = [self._read_chunk(chunks_file, r) for r in rows]
+                    result['document'] = '\n\n'.join(c['document'] for c in context)
+                    result['chunk_ids'] = [c['id'] for c in context]
+                results.append(result)
+        return results
+
+    def _similarities(self, query_embedding: np.ndarray) -> np.ndarray:
+        """
+        Cosine similarity of the query with every row. int8 rows are scored in blocks of SCORE_BLOCK_ROWS,
+        so only one block at a time is cast to float32 (instead of the whole matrix for every query).
+        """
+        if self.scales is None:
+            return self.vectors @ query_embedding
+        similarities = np.empty(len(self.vectors), dtype=np.float32)
+        for start in range(0, len(self.vectors), SCORE_BLOCK_ROWS):
+            end = start + SCORE_BLOCK_ROWS
+            np.dot(self.vectors[start:end].astype(np.float32), query_embedding, out=similarities[start:end])
+        return similarities * self.scales
+
+    def _searchable_rows(self, document_names: set = None):
+        if document_names is None:
+            return self.live_rows
+        rows = np.zeros(len(self.live_rows), dtype=bool)
+        for name in document_names:
+            document = self.store_info['documents'].get(name)
+            if document is not None:
+                rows[document['start']:document['start'] + document['count']] = True
+        return rows
+
+    def _matching_rows(self, ranked_rows, amount: int, where: dict, where_document: dict):
+        """The first `amount` rows (in ranked order) whose chunk matches the filters."""
+        matching = []
+        with open(self._file(CHUNKS_FILE), 'rb') as chunks_file:
+            for row in ranked_rows:
+                chunk_info = self._read_chunk(chunks_file, row)
+                if matches_where(chunk_info['metadata'], where) and \
+                        matches_where_document(chunk_info['document'], where_document):
+                    matching.append(row)
+                    if len(matching) == amount:
+                        break
+        return np.array(matching, dtype=np.int64)
+
+    def _read_chunk(self, chunks_file, row: int) -> dict:
+        chunks_file.seek(int(self.offsets[row]))
+        return json.loads(chunks_file.readline())
+
+    def _document_rows(self, row: int):
+        """First and last row of the document a row belongs to."""
+        for document in self.store_info['documents'].values():
+            if document['start'] <= row < document['start'] + document['count']:
+                return document['start'], document['start'] + document['count'] - 1
+        return row, row
+
+    def close(self):
+        """Drop the memory maps (the store reopens its files when used again)."""
+        self.vectors, self.scales, self.offsets, self.live_rows = None, None, None, None
+        self._loaded_mtime = None
+        self.query_embeddings.clear()
+
+    def compact(self):
+        """Rewrite the store files without the rows of removed documents (run it while no other process writes)."""
+        self._load()
+        if self.vectors is None:
+            return
+        documents = self.store_info['documents']
+        live = np.flatnonzero(self.live_rows)
+
+        with open(self._file(CHUNKS_FILE), 'rb') as chunks_file:
+            chunk_lines = []
+            for row in live:
+                chunks_file.seek(int(self.offsets[row]))
+                chunk_lines.append(chunks_file.readline())
+        vectors = np.array(self.vectors[live])
+        scales = None if self.scales is None else np.array(self.scales[live])
+
+        new_start = {}
+        row = 0
+        for name, document in sorted(documents.items(), key=lambda d: d[1]['start']):
+            new_start[name] = row
+            row += document['count']
+
+        # write new files next to the old ones and swap them in, so memory maps of other processes stay valid
+        vectors.tofile(self._file(VECTORS_FILE + '.tmp'))
+        os.replace(self._file(VECTORS_FILE + '.tmp'), self._file(VECTORS_FILE))
+        if scales is not None:
+            scales.tofile(self._file(SCALES_FILE + '.tmp'))
+            os.replace(self._file(SCALES_FILE + '.tmp'), self._file(SCALES_FILE))
+        offsets = np.cumsum([0] + [len(line) for line in chunk_lines[:-1]], dtype=np.int64)
+        offsets.tofile(self._file(OFFSETS_FILE + '.tmp'))
+        os.replace(self._file(OFFSETS_FILE + '.tmp'), self._file(OFFSETS_FILE))
+        with open(self._file(CHUNKS_FILE + '.tmp'), 'wb') as chunks_file:
+            chunks_file.writelines(chunk_lines)
+        os.replace(self._file(CHUNKS_FILE + '.tmp'), self._file(CHUNKS_FILE))
+
+        for name, start in new_start.items():
+            documents[name]['start'] = start
+        self.store_info['rows'] = len(live)
+        self._save_store_info()
+
+
+def normalize(embeddings) -> np.ndarray:
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    return embeddings / np.maximum(norms, 1e-12)
+
+
+def quantize_int8(embeddings: np.ndarray):
+    """Symmetric int8 quantization with one scale factor per row."""
+    scales = np.abs(embeddings).max(axis=1) / 127
+    scales = np.maximum(scales, 1e-12).astype(np.float32)
+    quantized = np.round(embeddings / scales[:, None]).astype(np.int8)
+    return quantized, scales
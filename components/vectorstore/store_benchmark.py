@@ -0,0 +1,233 @@
+import argparse
+import hashlib
+import json
+import platform
+import shutil
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import chromadb
+import numpy as np
+from chromadb import Documents, EmbeddingFunction, Embeddings
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+sys.path.append('../../')
+
+from components.text_utils.md_chunking import iterative_chunking
+from components.vectorstore.chroma_document_store import ChromaDocumentStore
+
+
+class HashingEmbeddingFunction(EmbeddingFunction):
+    """
+    Embeds text by hashing its words into a fixed number of dimensions. No model is needed, so benchmarks
+    with it measure the store itself (the default embedding model usually dominates ingest time).
+    """
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def __call__(self, input: Documents) -> Embeddings:
+        embeddings = []
+        for text in input:
+            embedding = np.zeros(self.dimension, dtype=np.float32)
+            for word in text.lower().split():
+                embedding[int(hashlib.md5(word.encode('utf-8')).hexdigest()[:8], 16) % self.dimension] += 1
+            embeddings.append(embedding / max(float(np.linalg.norm(embedding)), 1e-12))
+        return embeddings
+
+    @staticmethod
+    def name() -> str:
+        return 'hashing'
+
+    def get_config(self) -> dict:
+        return {'dimension': self.dimension}
+
+    @staticmethod
+    def build_from_config(config: dict):
+        return HashingEmbeddingFunction(config['dimension'])
+
+
+def synthetic_vocabulary(rng, size: int = 2000) -> list[str]:
+    syllables = ['ka', 'to', 'ri', 'men', 'sa', 'lo', 've', 'dan', 'pi', 'ter', 'no', 'ul', 'bra', 'si', 'gon', 'e']
+    words = set()
+    while len(words) < size:
+        words.add(''.join(rng.choice(syllables, size=rng.integers(1, 5))))
+    return sorted(words)
+
+
+class CorpusGenerator:
+    """Random Markdown documents (headers, paragraphs, lists and tables) with a Zipf-like word distribution."""
+
+    def __init__(self, seed: int = 0, sections: int = 4, paragraphs: int = 3):
+        self.rng = np.random.default_rng(seed)
+        self.vocabulary = synthetic_vocabulary(self.rng)
+        ranks = np.arange(1, len(self.vocabulary) + 1)
+        self.word_probabilities = (1 / ranks) / (1 / ranks).sum()
+        self.sections = sections
+        self.paragraphs = paragraphs
+
+    def words(self, count: int) -> str:
+        return ' '.join(self.rng.choice(self.vocabulary, size=count, p=self.word_probabilities))
+
+    def sentence(self) -> str:
+        return self.words(int(self.rng.integers(6, 20))).capitalize() + '.'
+
+    def document(self) -> str:
+        lines = [f'# {self.words(4).title()}']
+        for _ in range(self.sections):
+            lines.append(f'## {self.words(3).title()}')
+            for _ in range(self.paragraphs):
+                lines.append(' '.join(self.sentence() for _ in range(int(self.rng.integers(2, 7)))))
+            if self.rng.random() < 0.3:
+                lines.append('\n'.join(f'- {self.words(5)}' for _ in range(4)))
+            if self.rng.random() < 0.2:
+                rows = [f'| {self.words(1)} | {self.words(2)} | {int(self.rng.integers(1000))} |' for _ in range(4)]
+                lines.append('\n'.join(['| code | name | value |', '| --- | --- | --- |'] + rows))
+        return '\n\n'.join(lines)
+
+    def query(self) -> str:
+        return self.words(int(self.rng.integers(3, 8)))
+
+
+def percentiles_ms(latencies: list[float]) -> dict:
+    latencies_ms = np.array(latencies) * 1000
+    return {'p50_ms': float(np.percentile(latencies_ms, 50)),
+            'p95_ms': float(np.percentile(latencies_ms, 95)),
+            'p99_ms': float(np.percentile(latencies_ms, 99))}
+
+
+def run_benchmark(store_path: str, document_counts: list[int], amounts: list[int], query_count: int,
+                  embedding: str = 'default', shared_collection: bool = False, shard_count: int = 1,
+                  query_workers: int = 1, hybrid: bool = False, seed: int = 0) -> dict:
+    """
+    Grow one store to each of the document counts (in increasing order), measuring the ingest rate of every step,
+    then the latency of query_store for every amount (uncached, a new query every time).
+    """
+    embedding_function = HashingEmbeddingFunction() if embedding == 'hash' else DefaultEmbeddingFunction()
+    cdb_store = ChromaDocumentStore(path=store_path,
+                                    shared_collection=shared_collection,
+                                    shard_count=shard_count,
+                                    embedding_function=embedding_function,
+                                    query_workers=query_workers,
+                                    embedding_cache_size_mb=0,  # measure embedding, not cache hits
+                                    lexical_index=hybrid,
+                                    result_cache_size=0)
+    corpus = CorpusGenerator(seed)
+    silent_tqdm = lambda total: NoProgress()
+
+    results = {'ingest': [], 'query': []}
+    stored_documents = 0
+    for document_count in sorted(document_counts):
+        chunk_count, chunking_seconds, ingest_seconds = 0, 0.0, 0.0
+        while stored_documents < document_count:
+            md_text = corpus.document()
+            start = time.perf_counter()
+            chunks = iterative_chunking(md_text)
+            chunking_seconds += time.perf_counter() - start
+
+            meta_infos = [{'source': f'benchmark-{stored_documents}.md', 'id': f'chunk_{i}'} for i in range(len(chunks))]
+            start = time.perf_counter()
+            cdb_store.add_document(f'benchmark-document-{stored_documents}', chunks, meta_infos, tqdm_func=silent_tqdm)
+            ingest_seconds += time.perf_counter() - start
+            chunk_count += len(chunks)
+            stored_documents += 1
+        results['ingest'].append({'documents': document_count,
+                                  'added_chunks': chunk_count,
+                                  'chunking_seconds': chunking_seconds,
+                                  'ingest_seconds': ingest_seconds,
+                                  'chunks_per_second': chunk_count / ingest_seconds if ingest_seconds > 0 else None})
+        print(f'{document_count} documents: {results["ingest"][-1]["chunks_per_second"]:.1f} chunks/s')
+
+        for amount in amounts:
+            cdb_store.query_store(corpus.query(), amount, hybrid=hybrid)  # warm up
+            latencies = []
+            for _ in range(query_count):
+                query = corpus.query()
+                start = time.perf_counter()
+                cdb_store.query_store(query, amount, hybrid=hybrid)
+                latencies.append(time.perf_counter() - start)
+            results['query'].append({'documents': document_count, 'amount': amount, 'hybrid': hybrid,
+                                     **percentiles_ms(latencies),
+                                     'queries_per_second': len(latencies) / sum(latencies)})
+            print(f'{document_count} documents, amount {amount}: '
+                  f'p50 {results["query"][-1]["p50_ms"]:.1f} ms, p95 {results["query"][-1]["p95_ms"]:.1f} ms, '
+                  f'p99 {results["query"][-1]["p99_ms"]:.1f} ms')
+    cdb_store.close()
+    return results
+
+
+class NoProgress:
+    def update(self, n=1):
+        pass
+
+    def set_description(self, desc=None):
+        pass
+
+    def close(self):
+        pass
+
+
+def compare_results(results: dict, baseline: dict):
+    """Print the change of every measurement relative to an earlier run with the same settings."""
+    baseline_ingest = {row['documents']: row for row in baseline['ingest']}
+    for row in results['ingest']:
+        previous = baseline_ingest.get(row['documents'])
+        if previous is not None and previous['chunks_per_second']:
+            change = row['chunks_per_second'] / previous['chunks_per_second'] - 1
+            print(f'ingest {row["documents"]} documents: {change:+.1%} chunks/s')
+    baseline_query = {(row['documents'], row['amount'], row['hybrid']): row for row in baseline['query']}
+    for row in results['query']:
+        previous = baseline_query.get((row['documents'], row['amount'], row['hybrid']))
+        if previous is not None:
+            changes = ', '.join(f'{p} {row[p] / previous[p] - 1:+.1%}' for p in ['p50_ms', 'p95_ms', 'p99_ms'])
+            print(f'query {row["documents"]} documents, amount {row["amount"]}: {changes}')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures ingest throughput (chunks/s) and query_store latency '
+                                                 '(p50/p95/p99) of a ChromaDocumentStore on synthetic Markdown corpora, '
+                                                 'and writes the results as JSON, so runs can be compared.')
+    parser.add_argument('--documents', type=int, nargs='+', default=[10, 100, 1000],
+                        help='Document counts to measure at (the store grows from one to the next).')
+    parser.add_argument('--amounts', type=int, nargs='+', default=[1, 5, 20], help='query_store amount values.')
+    parser.add_argument('--queries', type=int, default=100, help='Number of queries per measurement.')
+    parser.add_argument('--embedding', choices=['default', 'hash'], default='default',
+                        help='default: the local embedding model (downloaded once), '
+                             'hash: word hashing, to measure the store without the model.')
+    parser.add_argument('--shared', action='store_true', help='Use the shared collection layout.')
+    parser.add_argument('--shards', type=int, default=1, help='Number of shared collections (with --shared).')
+    parser.add_argument('--query-workers', type=int, default=1)
+    parser.add_argument('--hybrid', action='store_true', help='Measure hybrid (vector + BM25) queries.')
+    parser.add_argument('--store', default=None, help='Folder for the store (default: a temporary folder).')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='store_benchmark.json', help='JSON file to write the results to.')
+    parser.add_argument('--baseline', default=None, help='Results of an earlier run to compare with.')
+    args = parser.parse_args()
+
+    store_path = args.store or tempfile.mkdtemp(prefix='store_benchmark_')
+    try:
+        benchmark_results = run_benchmark(store_path, args.documents, args.amounts, args.queries,
+                                          embedding=args.embedding,
+                                          shared_collection=args.shared,
+                                          shard_count=args.shards,
+                                          query_workers=args.query_workers,
+                                          hybrid=args.hybrid,
+                                          seed=args.seed)
+    finally:
+        if args.store is None:
+            shutil.rmtree(store_path, ignore_errors=True)
+
+    benchmark_results['settings'] = vars(args)
+    benchmark_results['environment'] = {'time': datetime.now().isoformat(timespec='seconds'),
+                                        'python': platform.python_version(),
+                                        'platform': platform.platform(),
+                                        'chromadb': chromadb.__version__}
+    with open(args.output, 'w', encoding='utf-8') as f:
+        json.dump(benchmark_results, f, indent=2)
+    print(f'Results written to {args.output}')
+
+    if args.baseline is not None:
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            compare_results(benchmark_results, json.load(f))
@@ -0,0 +1,51 @@
+import os
+import sys
+
+from chromadb.utils.embedding_functions import DefaultEmbeddingFunction
+
+sys.path.append('../../')
+
+from components.text_utils.string_utils import clean_up_string
+from components.vectorstore.chroma_document_store import ChromaDocumentStore
+from components.vectorstore.embedding_server import RemoteEmbeddingFunction
+from components.vectorstore.numpy_document_store import NumpyDocumentStore
+
+
+def default_embedding_function():
+    """The shared embedding worker when EMBEDDING_SERVER_URL is set, else Chroma's default (local ONNX) model."""
+    embedding_server_url = os.getenv('EMBEDDING_SERVER_URL')
+    if embedding_server_url:
+        return RemoteEmbeddingFunction(embedding_server_url)
+    return DefaultEmbeddingFunction()
+
+
+def create_document_store(path: str = None, backend: str = None, namespace: str = None, **chroma_options):
+    """
+    Open the document store backend chosen by configuration:
+    backend 'chroma' (default) or 'numpy' (flat memory-mapped store for read-mostly deployments).
+    When not given, the backend is read from the DOCUMENT_STORE_BACKEND environment variable,
+    and DOCUMENT_STORE_QUANTIZE=int8 stores the numpy embeddings as int8.
+    CHROMA_SERVER_URL connects the Chroma store to a Chroma server (client/server mode, namespace selects the
+    database there), EMBEDDING_SERVER_URL lets every store use one shared embedding worker (see embedding_server.py).
+    Options only the Chroma store understands (query_workers, lexical_index, ...) are ignored by the numpy store.
+    """
+    if backend is None:
+        backend = os.getenv('DOCUMENT_STORE_BACKEND', 'chroma')
+
+    if chroma_options.get('embedding_function') is None:
+        chroma_options['embedding_function'] = default_embedding_function()
+
+    if backend == 'numpy':
+        quantize = os.getenv('DOCUMENT_STORE_QUANTIZE', '') == 'int8'
+        return NumpyDocumentStore(path=path,
+                                  embedding_function=chroma_options.get('embedding_function'),
+                                  quantize=quantize)
+    if backend == 'chroma':
+        server_url = os.getenv('CHROMA_SERVER_URL')
+        if server_url and chroma_options.get('server_url') is None:
+            chroma_options['server_url'] = server_url
+            if namespace is not None:
+                chroma_options['database'] = f'namespace-{clean_up_string(namespace).strip("-")}'
+        return ChromaDocumentStore(path=path, **chroma_options)
+
+    raise ValueError(f'Unknown document store backend: {backend}')
@@ -0,0 +1,99 @@
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+sys.path.append('../../')
+
+from components.text_utils.string_utils import clean_up_string
+from components.vectorstore.store_factory import create_document_store, default_embedding_function
+
+NAMESPACE_FOLDER = 'namespaces'  # per-namespace stores are kept in this sub folder of the root store
+
+
+class DocumentStorePool:
+    """
+    One document store per namespace (a user or a team), opened the first time it is used.
+    At most max_open stores are kept open: the least recently used one is closed to make room for a new one,
+    and stores that have not been used for idle_timeout seconds are closed as well.
+    The namespace None is the store in the root folder itself (shared by everyone, as before namespaces).
+    Use `with pool.open_store(namespace) as store:`, a store is never closed while it is in use.
+    All stores share one embedding function (one copy of the embedding model), made when the pool is created.
+    """
+
+    def __init__(self, root_path: str, max_open: int = 16, idle_timeout: float = 1800, **store_options):
+        if root_path is None:
+            raise ValueError('DocumentStorePool needs a folder to keep the stores of the namespaces in')
+        self.root_path = root_path
+        self.max_open = max(1, max_open)
+        self.idle_timeout = idle_timeout
+        if store_options.get('embedding_function') is None:
+            store_options['embedding_function'] = default_embedding_function()
+        self.store_options = store_options
+        self._stores = OrderedDict()  # namespace -> {'store', 'last_used', 'users', 'evicted'}
+        self._lock = threading.Lock()
+
+    def namespace_path(self, namespace: str = None) -> str:
+        if namespace is None:
+            return self.root_path
+        return os.path.join(self.root_path, NAMESPACE_FOLDER, clean_up_string(namespace))
+
+    @contextmanager
+    def open_store(self, namespace: str = None):
+        entry = self._acquire(namespace)
+        try:
+            yield entry['store']
+        finally:
+            self._release(entry)
+
+    def _acquire(self, namespace: str):
+        with self._lock:
+            entry = self._stores.get(namespace)
+            if entry is None:
+                # opening a store reads its index files, other namespaces wait for that (it only happens once)
+                store = create_document_store(path=self.namespace_path(namespace), namespace=namespace,
+                                              **self.store_options)
+                entry = {'store': store, 'last_used': time.monotonic(), 'users': 0, 'evicted': False}
+                self._stores[namespace] = entry
+            self._stores.move_to_end(namespace)
+            entry['users'] += 1
+            entry['last_used'] = time.monotonic()
+            self._evict()
+        return entry
+
+    def _release(self, entry: dict):
+        with self._lock:
+            entry['users'] -= 1
+            entry['last_used'] = time.monotonic()
+            if entry['evicted'] and entry['users'] == 0:
+                entry['store'].close()
+
+    def _evict(self):
+        """Close idle stores and the least recently used ones beyond max_open (call while holding the lock)."""
+        now = time.monotonic()
+        for namespace in list(self._stores.keys()):
+            too_many = len(self._stores) > self.max_open
+            idle = self.idle_timeout is not None and now - self._stores[namespace]['last_used'] > self.idle_timeout
+            if too_many or idle:
+                entry = self._stores.pop(namespace)
+                entry['evicted'] = True
+                if entry['users'] == 0:
+                    entry['store'].close()
+
+    def close_idle(self):
+        with self._lock:
+            self._evict()
+
+    def close_all(self):
+        with self._lock:
+            for entry in self._stores.values():
+                entry['evicted'] = True
+                if entry['users'] == 0:
+                    entry['store'].close()
+            self._stores.clear()
+
+    def open_namespaces(self) -> list:
+        with self._lock:
+            return list(self._stores.keys())
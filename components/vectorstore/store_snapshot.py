@@ -0,0 +1,22 @@
+import argparse
+import sys
+
+sys.path.append('../../')
+
+from components.vectorstore.chroma_document_store import ChromaDocumentStore
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Exports a ChromaDocumentStore to a compact .npz snapshot, or imports '
+                                                 'one, e.g. to bring up a new replica without re-embedding documents.')
+    parser.add_argument('command', choices=['export', 'import'])
+    parser.add_argument('store', help='Path of the store (CHROMA_LOCATION).')
+    parser.add_argument('snapshot', help='Snapshot file (.npz).')
+    parser.add_argument('--shared', action='store_true', help='The store uses the shared collection layout.')
+    parser.add_argument('--shards', type=int, default=1, help='Number of shared collections (with --shared).')
+    args = parser.parse_args()
+
+    cdb_store = ChromaDocumentStore(path=args.store, shared_collection=args.shared, shard_count=args.shards)
+    if args.command == 'export':
+        cdb_store.export_snapshot(args.snapshot)
+    else:
+        cdb_store.import_snapshot(args.snapshot)
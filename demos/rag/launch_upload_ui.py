@@ -1,31 +1,18 @@
 import sys
 
 import gradio as gr
-from tqdm import tqdm
 
 sys.path.append('../../')
 
-from components.text_utils.md_chunking import iterative_chunking
-from components.text_utils.md_conversion import document_to_markdown
-from components.text_utils.string_utils import sanitize_filename
 from components.vectorstore.chroma_document_store import ChromaDocumentStore
+from components.vectorstore.file_ingest import ingest_files
 
 cdb_store = ChromaDocumentStore(path='store/')
 
 
 def on_file_uploaded(file_list, progress=gr.Progress(track_tqdm=True)):
-    current_documents = cdb_store.list_documents()
-    for file_path in file_list:
-        collection_name = sanitize_filename(file_path)
-        if collection_name not in current_documents:
-            md_text = document_to_markdown(file_path)
-            chunks = iterative_chunking(md_text)
-            meta_info = [{'source': file_path, 'id': f'chunk_{i}'} for i in range(len(chunks))]
-            cdb_store.add_document(document_name=collection_name,
-                                   chunks=chunks,
-                                   meta_infos=meta_info,
-                                   tqdm_func=tqdm)
-
+    # files are converted and chunked in parallel, and written one after the other
+    ingest_files(cdb_store, file_list, progress=progress)
     return None, refresh_document_choices()
 
 
@@ -72,4 +59,5 @@ with gr.Blocks(fill_height=True, title='RAG Upload Demo') as cdb_demo:
     btn_remove_rag_file.click(on_remove_rag, [rd_rag_files], [rd_rag_files])
     cdb_demo.load(refresh_document_choices, [], [rd_rag_files])
 
-cdb_demo.queue().launch(server_name='0.0.0.0', server_port=7021, css=custom_css)
+if __name__ == '__main__':  # not in the worker processes that convert uploaded files
+    cdb_demo.queue().launch(server_name='0.0.0.0', server_port=7021, css=custom_css)
@@ -7,7 +7,8 @@ from slack_bolt import App
 from slack_bolt.adapter.socket_mode import SocketModeHandler
 
 from components.open_router.open_router_client import OpenRouterClient
-from demos.tool_calling.tool_descriptors import (tools_rag_descriptor,
+from demos.tool_calling.tool_descriptors import (declared_arguments,
+                                                 tools_rag_descriptor,
                                                  tools_search_descriptor,
                                                  tools_get_website_contents)
 # noinspection PyUnresolvedReferences
@@ -86,6 +87,7 @@ def handle_tool_calls(tool_calls, message_list):
                 fn_args = {}
             else:
                 fn_args = json.loads(call.function.arguments)
+            fn_args = declared_arguments(tool_list, call.function.name, fn_args)  # only what the tool declares
             tool_call_obj = {
                 'role': 'assistant',
                 'content': None,
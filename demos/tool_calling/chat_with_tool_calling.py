@@ -9,7 +9,8 @@ sys.path.append('../../')
 
 from components.open_router.open_router_client import OpenRouterClient
 from demos.tool_calling.descriptors_fileio import tools_fileio_descriptor
-from demos.tool_calling.tool_descriptors import (tools_search_descriptor,
+from demos.tool_calling.tool_descriptors import (declared_arguments,
+                                                 tools_search_descriptor,
                                                  tools_get_website_contents,
                                                  tools_weather_descriptor,
                                                  tools_rag_descriptor)
@@ -127,6 +128,7 @@ def complete_with_llm(chat_history, message_list):
                 fn_args = json.loads(call.function.arguments)
             else:
                 fn_args = {}
+            fn_args = declared_arguments(tool_list, call.function.name, fn_args)  # only what the tool declares
             tool_call_obj = {
                 'role': 'assistant',
                 'content': None,
@@ -1,5 +1,15 @@
 # JSON description of available methods
 
+
+def declared_arguments(tool_list: list, function_name: str, arguments: dict) -> dict:
+    """The arguments of a tool call that the descriptor of the function declares; anything else is dropped."""
+    for tool in tool_list:
+        if tool.get('function', {}).get('name') == function_name:
+            properties = tool['function'].get('parameters', {}).get('properties', {})
+            return {name: value for name, value in arguments.items() if name in properties}
+    return {}
+
+
 # RAG
 tools_rag_descriptor = [{
     "type": "function",
@@ -8,15 +18,28 @@ tools_rag_descriptor = [{
         "description": "Get snippets from documents related to the domain you operate in. "
                        "Put in natural language questions or statements as search queries. "
                        "Use compact phrases focusing on the essence of what you are looking for. "
-                       "The method will return an array of JSON objects, containing a 'documents' part with the associated text, "
+                       "The method will return an array of JSON objects, containing a 'documents' part with the associated text (the matching chunk together with the chunks around it), "
                        "a 'distances' value indicating how well the info matches your question (smaller numbers are better), "
+                       "or a 'score' value when lexical and semantic search results are combined (higher numbers are better), "
                        "and a 'metadatas' object with some info about the text chunks: document name, page number, and a paragraph (chunk) number. "
                        "Always include the document name and page number when referencing this documentation.",
         "parameters": {
             "type": "object",
             "properties": {
                 "query": {"type": "string",
-                          "description": "A natural language statement to search for in the documentation"}
+                          "description": "A natural language statement to search for in the documentation"},
+                "where": {"type": "object",
+                          "description": "Optional filter on the chunk metadata, in ChromaDB syntax. "
+                                         "Examples: {\"document\": \"<document name from list_documents>\"}, "
+                                         "{\"uploaded_at\": {\"$gte\": <unix timestamp>}}, "
+                                         "{\"header_path\": \"Installation > Linux\"} (the headers above the chunk), "
+                                         "{\"page_start\": {\"$lte\": <page>}} (pages are known for PDFs), "
+                                         "{\"$and\": [{\"document\": {\"$in\": [\"<name>\", \"<name>\"]}}, "
+                                         "{\"uploaded_at\": {\"$lt\": <unix timestamp>}}]}. "
+                                         "Leave it out to search all documents."},
+                "where_document": {"type": "object",
+                                   "description": "Optional filter on the chunk text, in ChromaDB syntax, "
+                                                  "e.g. {\"$contains\": \"exact phrase\"}."}
             },
             "required": ["query"],
         },
@@ -5,19 +5,33 @@ from dotenv import load_dotenv
 
 sys.path.append('../')
 
-from components.vectorstore.chroma_document_store import ChromaDocumentStore
+from components.vectorstore.store_pool import DocumentStorePool
 
 load_dotenv()
 
 cdb_path = os.getenv("CHROMA_LOCATION")
-cdb_store = ChromaDocumentStore(path=cdb_path)  # on disk
+# the shared store, opened on first use and closed when idle; backend set by DOCUMENT_STORE_BACKEND
+store_pool = DocumentStorePool(cdb_path,
+                               max_open=int(os.getenv("RAG_MAX_OPEN_STORES", "16")),
+                               idle_timeout=float(os.getenv("RAG_STORE_IDLE_TIMEOUT", "1800")),
+                               query_workers=8,
+                               query_deadline=10.0,
+                               lexical_index=True)
 
 
+# the tools below only search the shared store: the model chooses their arguments,
+# so a per-user namespace must never be one of them (see rag_tools in applications/chat_with_rag/fn_rag.py)
 def list_documents():
-    return cdb_store.list_documents()
+    with store_pool.open_store() as cdb_store:
+        return cdb_store.list_documents()
 
 
-def lookup_in_documentation(query):
+def lookup_in_documentation(query, where=None, where_document=None):
     print(f"Searching in company docs: '{query}'")
-    results = cdb_store.query_store(query)
+    try:
+        with store_pool.open_store() as cdb_store:
+            results = cdb_store.query_store(query, hybrid=True, mmr_lambda=0.7, neighbors=1,
+                                            where=where, where_document=where_document)
+    except ValueError as e:  # an invalid filter: let the model correct it
+        return {'error': f'Invalid filter: {e}'}
     return results[:5]